@@ -0,0 +1,291 @@
+"""Offline engine analysis of logged games.
+
+Streams through game logs (or compact archives), searches every position at
+a fixed depth or node budget, and reports each side's accuracy along with
+the blunders, mistakes and inaccuracies it made:
+
+    python analyze_games.py --depth 4 --workers 8
+    python analyze_games.py chess_games/games.cga --nodes 20000 --summary audit.csv
+
+Games are read in batches of --batch-games, so memory holds one batch of
+games at a time however large the corpus is. Openings repeat heavily, so
+each distinct position is searched once and its result is kept in a cache
+file next to the summary. Results are appended to the cache as they come
+in, so an interrupted run picks up where it stopped, and later runs only
+search positions they haven't seen.
+"""
+import argparse
+import csv
+import itertools
+import math
+import multiprocessing
+import os
+import struct
+import sys
+import time
+
+from game_archive import game_from_log, iter_archive
+from game_logs import list_game_logs
+from position import Position, generate_legal_moves, move_to_uci
+from search import MATE_SCORE, Search
+from tablebase import Tablebase
+from transposition import TranspositionTable
+
+# key, score for the side to move, best move
+CACHE_RECORD = struct.Struct('<QiH')
+ANALYSIS_HASH_MB = 4
+
+# Centipawn loss thresholds, strictest first
+BLUNDER, MISTAKE, INACCURACY = 300, 100, 50
+# Mate scores count as this many centipawns when measuring a move's loss
+MATE_CENTIPAWNS = 1000
+# Games replayed and searched together; bounds what a run keeps in memory
+BATCH_GAMES = 500
+
+SUMMARY_FIELDS = ['game', 'result', 'plies', 'white_accuracy', 'black_accuracy', 'white_blunders',
+                  'black_blunders', 'white_mistakes', 'black_mistakes', 'white_inaccuracies',
+                  'black_inaccuracies', 'flagged']
+
+# Set up once per worker process by _init_worker
+_worker_search = None
+
+
+def _init_worker(depth, nodes):
+    global _worker_search
+    _worker_search = Search(time_limit=None, max_depth=depth or 64,
+                            tt=TranspositionTable(ANALYSIS_HASH_MB), tablebase=Tablebase())
+    _worker_search.node_limit = nodes
+
+
+def analyse_position(task):
+    """Worker: (key, fen) -> (key, score for the side to move, best move)"""
+    key, fen = task
+    position = Position.from_fen(fen)
+    if not generate_legal_moves(position):
+        return key, (-MATE_SCORE if position.in_check() else 0), 0
+    _worker_search.tt.clear()
+    move, score, depth = _worker_search.search(position)
+    return key, score, move
+
+
+def cache_path(summary_path, depth, nodes):
+    setting = f"d{depth}" if depth else f"n{nodes}"
+    return os.path.splitext(summary_path)[0] + f"_{setting}.cache"
+
+
+def load_cache(path):
+    """{key: (score, move)}; a record cut short by an interruption is dropped"""
+    cache = {}
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        usable = len(data) - len(data) % CACHE_RECORD.size
+        for key, score, move in CACHE_RECORD.iter_unpack(data[:usable]):
+            cache[key] = (score, move)
+        if usable != len(data):
+            with open(path, 'r+b') as f:
+                f.truncate(usable)
+    return cache
+
+
+def iter_games(sources):
+    """Yield (name, ArchivedGame) from text logs and .cga archives"""
+    for source in sources:
+        if source.endswith('.cga'):
+            for number, game in enumerate(iter_archive(source), 1):
+                yield f"{source}#{number}", game
+        else:
+            try:
+                yield source, game_from_log(source)
+            except OSError as e:
+                print(f"Skipping {source}: {e}")
+
+
+def iter_batches(sources, batch_games=BATCH_GAMES):
+    """Yield lists of up to batch_games (name, ArchivedGame) pairs"""
+    games = iter_games(sources)
+    while True:
+        batch = list(itertools.islice(games, batch_games))
+        if not batch:
+            return
+        yield batch
+
+
+def collect_positions(batch):
+    """Replay a batch of games once: per-game ply lists and the distinct positions to search"""
+    games = []
+    positions = {}
+    for name, game in batch:
+        plies = []
+        position = None
+        for position, move in game.positions():
+            positions.setdefault(position.hash, position.to_fen(full=True))
+            plies.append((position.hash, move, position.turn))
+        if position is None:
+            continue
+        # positions() has played the last move by now; this scores it
+        positions.setdefault(position.hash, position.to_fen(full=True))
+        plies.append((position.hash, 0, position.turn))
+        games.append((name, game.result, plies))
+    return games, positions
+
+
+def clamp(score):
+    return max(-MATE_CENTIPAWNS, min(MATE_CENTIPAWNS, score))
+
+
+def win_percent(centipawns):
+    """Expected score in percent for a centipawn advantage"""
+    return 50 + 50 * (2 / (1 + math.exp(-0.00368208 * centipawns)) - 1)
+
+
+def move_accuracy(before, after):
+    """Accuracy of a move from the win percentages before and after it"""
+    accuracy = 103.1668 * math.exp(-0.04354 * (win_percent(before) - win_percent(after))) - 3.1669
+    return max(0.0, min(100.0, accuracy))
+
+
+def grade(loss):
+    if loss >= BLUNDER:
+        return 'blunder'
+    if loss >= MISTAKE:
+        return 'mistake'
+    if loss >= INACCURACY:
+        return 'inaccuracy'
+    return None
+
+
+def analyse_game(plies, cache):
+    """Per-side accuracy and graded moves for one game"""
+    sides = {color: {'accuracy': [], 'blunder': 0, 'mistake': 0, 'inaccuracy': 0} for color in ('white', 'black')}
+    flagged = []
+    for ply, ((key, move, color), (next_key, _, _)) in enumerate(zip(plies, plies[1:]), 1):
+        best_score, best_move = cache[key]
+        before = clamp(best_score)
+        after = before if move == best_move else clamp(-cache[next_key][0])
+        loss = max(0, before - after)
+        side = sides[color]
+        side['accuracy'].append(move_accuracy(before, min(after, before)))
+        kind = grade(loss)
+        if kind:
+            side[kind] += 1
+            number = f"{(ply + 1) // 2}{'.' if color == 'white' else '...'}"
+            flagged.append(f"{number}{move_to_uci(move)}?{'?' if kind == 'blunder' else ''} "
+                           f"(-{loss}, best {move_to_uci(best_move)})")
+    for side in sides.values():
+        scores = side.pop('accuracy')
+        side['accuracy'] = sum(scores) / len(scores) if scores else None
+    return sides, flagged
+
+
+def run_analysis(sources, depth=None, nodes=None, workers=None, summary_path="analysis_summary.csv",
+                 verbose=True, batch_games=BATCH_GAMES):
+    """Analyse the games in sources, writing a CSV row per game; returns run totals.
+
+    Rows go straight to the summary file, so only the totals grow with
+    the corpus: games, plies and positions searched, and per side the
+    mean game accuracy and the graded move counts.
+    """
+    if not depth and not nodes:
+        depth = 4
+    started = time.perf_counter()
+    cache_file = cache_path(summary_path, depth, nodes)
+    cache = load_cache(cache_file)
+    if verbose:
+        print(f"{len(cache)} position(s) already in {cache_file}")
+
+    totals = {'games': 0, 'plies': 0, 'searched': 0}
+    for color in ('white', 'black'):
+        totals[color] = {'accuracy': None, 'blunder': 0, 'mistake': 0, 'inaccuracy': 0}
+    accuracy_sums = {'white': [0.0, 0], 'black': [0.0, 0]}
+    pool = None
+    # Unbuffered, so every finished search survives an interruption
+    with open(cache_file, 'ab', buffering=0) as out, open(summary_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        try:
+            for number, batch in enumerate(iter_batches(sources, batch_games), 1):
+                games, positions = collect_positions(batch)
+                pending = [(key, fen) for key, fen in positions.items() if key not in cache]
+                if verbose:
+                    print(f"Batch {number}: {len(games)} game(s), {len(positions)} distinct positions, "
+                          f"{len(pending)} to search")
+                if pending:
+                    if pool is None:
+                        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(depth, nodes))
+                    for done, (key, score, move) in enumerate(pool.imap_unordered(analyse_position, pending, 16), 1):
+                        cache[key] = (score, move)
+                        out.write(CACHE_RECORD.pack(key, score, move))
+                        totals['searched'] += 1
+                        if verbose and (done % 500 == 0 or done == len(pending)):
+                            elapsed = time.perf_counter() - started
+                            print(f"[{done}/{len(pending)}] {totals['searched'] / elapsed:.1f} positions/s")
+
+                for name, result, plies in games:
+                    sides, flagged = analyse_game(plies, cache)
+                    writer.writerow(summary_row(name, result, plies, sides, flagged))
+                    totals['games'] += 1
+                    totals['plies'] += len(plies) - 1
+                    for color, side in sides.items():
+                        for kind in ('blunder', 'mistake', 'inaccuracy'):
+                            totals[color][kind] += side[kind]
+                        if side['accuracy'] is not None:
+                            accuracy_sums[color][0] += side['accuracy']
+                            accuracy_sums[color][1] += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    for color, (total, count) in accuracy_sums.items():
+        totals[color]['accuracy'] = total / count if count else None
+    return totals
+
+
+def summary_row(name, result, plies, sides, flagged):
+    return {
+        'game': name,
+        'result': result or '',
+        'plies': len(plies) - 1,
+        'white_accuracy': _format_accuracy(sides['white']['accuracy']),
+        'black_accuracy': _format_accuracy(sides['black']['accuracy']),
+        'white_blunders': sides['white']['blunder'],
+        'black_blunders': sides['black']['blunder'],
+        'white_mistakes': sides['white']['mistake'],
+        'black_mistakes': sides['black']['mistake'],
+        'white_inaccuracies': sides['white']['inaccuracy'],
+        'black_inaccuracies': sides['black']['inaccuracy'],
+        'flagged': '; '.join(flagged),
+    }
+
+
+def _format_accuracy(accuracy):
+    return '' if accuracy is None else f"{accuracy:.1f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rerun the engine over logged games and grade every move")
+    parser.add_argument("sources", nargs='*', help="game logs or .cga archives (default: chess_games/*.txt)")
+    budget = parser.add_mutually_exclusive_group()
+    budget.add_argument("--depth", type=int, default=None, help="search depth per position (default 4)")
+    budget.add_argument("--nodes", type=int, default=None, help="node budget per position instead of a depth")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--summary", default="analysis_summary.csv", help="CSV summary to write")
+    parser.add_argument("--batch-games", type=int, default=BATCH_GAMES,
+                        help=f"games replayed and searched at a time (default {BATCH_GAMES})")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    totals = run_analysis(args.sources or list_game_logs(), args.depth, args.nodes, args.workers, args.summary,
+                          batch_games=args.batch_games)
+    print(f"\n{totals['games']} game(s), {totals['plies']} plies, {totals['searched']} position(s) searched")
+    print(f"{'side':6} {'accuracy':>8} {'??':>5} {'?':>5} {'?!':>5}")
+    for color in ('white', 'black'):
+        side = totals[color]
+        print(f"{color:6} {_format_accuracy(side['accuracy']):>8} {side['blunder']:5} "
+              f"{side['mistake']:5} {side['inaccuracy']:5}")
+    print(f"\nWrote {args.summary} in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,19 @@
 import random
+import sys
 import time
 import datetime
-import glob
+from array import array
+from collections import OrderedDict, namedtuple
+
+from position import Position, generate_legal_moves, move_promotion, move_to_coordinates, \
+    NO_PROMOTION, QUEEN_PROMOTION
+from opening_book import BOOK_PATH, MIN_BOOK_GAMES, OpeningBook, update_book
+from parallel_search import ParallelSearch
+from pondering import Ponderer
+import profiling
+from search import Search
+from tablebase import Tablebase
+from transposition import TranspositionTable
 
 # ANSI escape codes for color
 WHITE_PIECE_COLOR = "\033[97m" 
@@ -12,6 +24,21 @@ ROW_COLOR = "\033[32m"
 RESET_COLOR = "\033[0m" 
 RED_ALERT = "\033[31m[LEARNING]\033[0m "
 
+# Seconds the hard AI spends searching each move
+HARD_MOVE_TIME = 1.0
+# Memory cap for the hard AI's transposition table
+HARD_HASH_MB = 16
+# Processes the hard AI searches with; more than one uses the Lazy SMP search
+HARD_SEARCH_WORKERS = 1
+# Search the expected reply while the human thinks (single-process search only)
+HARD_PONDER = True
+# Positions whose legal moves and check status are kept between turns
+POSITION_CACHE_SIZE = 4096
+# Timed when a game is played with CHESS_PROFILE set (see profiling.py)
+PROFILED_FUNCTIONS = ['show_legal_moves', 'is_in_check', 'is_checkmate', 'board_to_fen',
+                      'get_legal_moves', 'generate_random_move',
+                      'generate_medium_move', 'generate_hard_move']
+
 # Representing the chess board
 def initialize_board():
     board = [
@@ -61,65 +88,30 @@ def parse_fen(fen_str):
     return board
 
 class GameMemory:
-    def __init__(self):
-        self.memory = {}
-        self.load_all_games()
+    """Moves learned from past games, looked up in the compiled opening book"""
+    def __init__(self, book_path=BOOK_PATH, min_games=MIN_BOOK_GAMES):
+        self.book_path = book_path
+        self.min_games = min_games
+        self.book = OpeningBook(book_path)
     
-    def load_all_games(self):
-        game_files = glob.glob("chess_games/*.txt")
-        for game_file in game_files:
-            self.process_game_file(game_file)
+    def update(self, log_files=None):
+        """Fold in logs that are new or changed since they were last read"""
+        self.book.close()
+        updated = update_book(self.book_path, log_files)
+        self.book = OpeningBook(self.book_path)
+        return updated
     
-    def process_game_file(self, filename):
-        try:
-            with open(filename, 'r') as f:
-                lines = f.readlines()
-            
-            result = None
-            moves = []
-            for line in lines:
-                if line.startswith("Result:"):
-                    result = line.split(":", 1)[1].strip()
-                elif line.startswith("Move:"):
-                    moves.append(line.strip().split(":", 2)[1:])
-            
-            if not result or not moves:
-                return
-            
-            white_outcome = None
-            if "White wins" in result:
-                white_outcome = 'win'
-            elif "Black wins" in result:
-                white_outcome = 'loss'
-            else:
-                white_outcome = 'draw'
-            
-            board = initialize_board()
-            current_turn = 'white'
-            for move in moves:
-                fen_before, move_uci = move
-                board_state = parse_fen(fen_before)
-                outcome = white_outcome if current_turn == 'white' else 'loss' if white_outcome == 'win' else 'win' if white_outcome == 'loss' else 'draw'
-                
-                if fen_before not in self.memory:
-                    self.memory[fen_before] = {}
-                
-                if move_uci not in self.memory[fen_before]:
-                    self.memory[fen_before][move_uci] = {'wins': 0, 'losses': 0, 'draws': 0}
-                
-                if outcome == 'win':
-                    self.memory[fen_before][move_uci]['wins'] += 1
-                elif outcome == 'loss':
-                    self.memory[fen_before][move_uci]['losses'] += 1
-                else:
-                    self.memory[fen_before][move_uci]['draws'] += 1
-                
-                # Update board state silently
-                start, end = notation_to_coordinates(move_uci)
-                move_piece(board_state, start, end, silent=True)  # Added silent=True here
-                current_turn = 'black' if current_turn == 'white' else 'white'
-        except Exception as e:
-            print(f"Error processing {filename}: {e}")
+    def record_game(self, filename):
+        """Learn from a game as soon as its log is saved"""
+        return self.update([filename])
+    
+    def lookup(self, board, color):
+        """Every book move from this position as BookMove records"""
+        return self.book.lookup(Position.board_hash(board, color))
+
+    def choose_move(self, board, color):
+        """The best-supported book move, or None if none has min_games behind it"""
+        return self.book.choose(Position.board_hash(board, color), self.min_games)
 
 def get_rating():
     try:
@@ -186,71 +178,80 @@ def generate_medium_move(board, color):
     moves = []
     capture_moves = []
     
-    for i in range(8):
-        for j in range(8):
-            if (color == 'white' and board[i][j].isupper()) or (color == 'black' and board[i][j].islower()):
-                legal_moves = show_legal_moves(board, (i, j))
-                for end in legal_moves:
-                    target = board[end[0]][end[1]]
-                    if target != '.':
-                        capture_moves.append(((i, j), end))
-                    else:
-                        moves.append(((i, j), end))
+    for start, end in get_legal_moves(board, color):
+        target = board[end[0]][end[1]]
+        if target != '.':
+            capture_moves.append((start, end))
+        else:
+            moves.append((start, end))
     
     # Prefer capture moves if available
     if capture_moves:
         return random.choice(capture_moves)
     return random.choice(moves) if moves else None
 
-def generate_hard_move(board, color, memory):
-    current_fen = board_to_fen(board, color)
-    if current_fen in memory.memory:
-        moves = memory.memory[current_fen]
-        best_move = None
-        best_score = -float('inf')
-        
-        for move, stats in moves.items():
-            total = stats['wins'] + stats['losses'] + stats['draws']
-            if total == 0:
-                continue
-            score = (stats['wins'] - stats['losses']) / total
-            if score > best_score:
-                best_score = score
-                best_move = move
-            elif score == best_score:
-                if random.random() < 0.5:
-                    best_move = move
-        
-        if best_move:
-            print(f"{RED_ALERT}Using learned move: {best_move}")
-            return notation_to_coordinates(best_move)
+# One search for the whole session so its transposition table stays warm
+# between moves
+_hard_search = None
+
+def get_hard_search(workers=HARD_SEARCH_WORKERS):
+    global _hard_search
+    if _hard_search is None or getattr(_hard_search, 'workers', 1) != workers:
+        if isinstance(_hard_search, ParallelSearch):
+            _hard_search.close()
+        if workers > 1:
+            _hard_search = ParallelSearch(workers, HARD_MOVE_TIME, hash_mb=HARD_HASH_MB)
+        else:
+            _hard_search = Search(time_limit=HARD_MOVE_TIME, tt=TranspositionTable(HARD_HASH_MB),
+                                  tablebase=Tablebase())
+        # The board always promotes the AI's pawns to queens
+        _hard_search.queen_promotions_only = True
+    return _hard_search
+
+_ponderer = None
+
+def get_ponderer(workers=HARD_SEARCH_WORKERS):
+    """The Ponderer for the hard AI's search, or None if it can't ponder"""
+    global _ponderer
+    search = get_hard_search(workers)
+    if not HARD_PONDER or isinstance(search, ParallelSearch):
+        return None
+    if _ponderer is None or _ponderer.search is not search:
+        _ponderer = Ponderer(search)
+    return _ponderer
+
+def generate_hard_move(board, color, memory, time_limit=HARD_MOVE_TIME, silent=False,
+                       workers=HARD_SEARCH_WORKERS, ponderer=None):
+    book_move = memory.choose_move(board, color) if memory is not None else None
+    if book_move is not None and \
+            book_move.move not in [move & 0xFFF for move in _position_cache.lookup(board, color).moves]:
+        # A corrupt log line or a hash collision; the book moves carry no
+        # promotion piece, hence comparing from and to squares only
+        book_move = None
+    if book_move is not None:
+        if ponderer is not None:
+            ponderer.stop()
+        if not silent:
+            print(f"{RED_ALERT}Using learned move: {book_move.uci} "
+                  f"({book_move.total} games, {book_move.score:.0%} scored)")
+        profiling.note(book_hit=True)
+        return move_to_coordinates(book_move.move)
     
-    # Fallback to original hard move logic
-    piece_values = {'p': 1, 'n': 3, 'b': 3, 'r': 5, 'q': 9, 'k': 0,
-                    'P': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 0}
-    best_move = None
-    best_value = -999
+    # Fall back to an alpha-beta search for the time an AI move is allowed,
+    # part or all of which may have been spent pondering this very position
+    search = get_hard_search(workers)
+    pondered = ponderer.finish(board, color, time_limit) if ponderer is not None else None
+    if pondered is not None:
+        best_move, score, depth = pondered
+    else:
+        search.time_limit = time_limit
+        best_move, score, depth = search.search(Position.from_board(board, color))
+    profiling.note(book_hit=False, ponder_hit=pondered is not None, nodes=search.nodes, depth=depth, score=score)
+    if ponderer is not None:
+        profiling.note(ponder_hits=ponderer.hits, ponder_misses=ponderer.misses,
+                       ponder_hit_rate=round(ponderer.hit_rate, 3))
     
-    for i in range(8):
-        for j in range(8):
-            if (color == 'white' and board[i][j].isupper()) or (color == 'black' and board[i][j].islower()):
-                legal_moves = show_legal_moves(board, (i, j))
-                for end in legal_moves:
-                    current_value = 0
-                    target = board[end[0]][end[1]]
-                    if target != '.':
-                        current_value += piece_values.get(target, 0)
-                    
-                    if color == 'white':
-                        current_value += (7 - end[0]) * 0.1
-                    else:
-                        current_value += end[0] * 0.1
-                        
-                    if current_value > best_value:
-                        best_value = current_value
-                        best_move = ((i, j), end)
-    
-    return best_move if best_move else generate_medium_move(board, color)
+    return move_to_coordinates(best_move) if best_move else generate_medium_move(board, color)
 
 
 
@@ -293,22 +294,56 @@ def move_piece(board, start, end, silent=False):
     board[end_row][end_col] = piece
     board[start_row][start_col] = '.'
 
+# What the game loop, the AI and the square/piece queries ask about a position.
+# moves are packed as in position.py; status is 'checkmate', 'stalemate' or None.
+PositionInfo = namedtuple('PositionInfo', ['moves', 'in_check', 'status'])
+
+class PositionCache:
+    """Legal moves and check status per position, keyed by Zobrist hash.
+
+    A turn asks about the same position several times (mate checks, the
+    AI's move, its validation, square queries); only the first generates
+    moves. The least recently used positions are dropped past size.
+    """
+    def __init__(self, size=POSITION_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, board, color):
+        key = Position.board_hash(board, color)
+        info = self.entries.get(key)
+        if info is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return info
+        self.misses += 1
+        position = Position.from_board(board, color)
+        # Promotions collapse to a single entry since the piece is chosen
+        # after the move is made
+        moves = array('H', [move for move in generate_legal_moves(position, color)
+                            if move_promotion(move) in (NO_PROMOTION, QUEEN_PROMOTION)])
+        in_check = position.in_check()
+        status = None if moves else ('checkmate' if in_check else 'stalemate')
+        info = PositionInfo(moves, in_check, status)
+        self.entries[key] = info
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return info
+
+    def clear(self):
+        self.entries.clear()
+
+_position_cache = PositionCache()
+
+# All strictly legal moves for a side as (start, end) pairs
+def get_legal_moves(board, color):
+    return [move_to_coordinates(move) for move in _position_cache.lookup(board, color).moves]
+
 # Generate random moves (easy AI)
 def generate_random_move(board, color):
-    valid_moves = []
-    in_check = is_in_check(board, color)
-    
-    for i in range(8):
-        for j in range(8):
-            piece = board[i][j]
-            if (color == 'white' and piece.isupper()) or (color == 'black' and piece.islower()):
-                moves = show_legal_moves(board, (i, j))
-                for move in moves:
-                    temp_board = simulate_move(board, (i, j), move)
-                    # Only consider moves that resolve check if in check
-                    if not in_check or not is_in_check(temp_board, color):
-                        valid_moves.append(((i, j), move))
-    
+    valid_moves = get_legal_moves(board, color)
     return random.choice(valid_moves) if valid_moves else None
 
 
@@ -318,30 +353,71 @@ def is_in_check(board, color):
         return False
     
     opponent_color = 'black' if color == 'white' else 'white'
-    for row in range(8):
-        for col in range(8):
-            piece = board[row][col]
-            if piece != '.' and ((opponent_color == 'white' and piece.isupper()) or \
-                                 (opponent_color == 'black' and piece.islower())):
-                moves = show_legal_moves(board, (row, col))
-                if king_pos in moves:
-                    return True
+    return is_square_attacked(board, king_pos, opponent_color)
+
+KNIGHT_OFFSETS = [(-2, -1), (-2, 1), (2, -1), (2, 1),
+                  (-1, -2), (1, -2), (-1, 2), (1, 2)]
+KING_OFFSETS = [(-1, 0), (1, 0), (0, -1), (0, 1),
+                (-1, -1), (-1, 1), (1, -1), (1, 1)]
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+# Check whether a square is attacked by working outward from it
+def is_square_attacked(board, square, by_color):
+    row, col = square
+    if by_color == 'white':
+        pawn, knight, bishop, rook, queen, king = 'P', 'N', 'B', 'R', 'Q', 'K'
+        pawn_row = row + 1  # White pawns capture towards row 0
+    else:
+        pawn, knight, bishop, rook, queen, king = 'p', 'n', 'b', 'r', 'q', 'k'
+        pawn_row = row - 1
+
+    # Pawn diagonals
+    for dy in [-1, 1]:
+        if is_in_bounds(pawn_row, col + dy) and board[pawn_row][col + dy] == pawn:
+            return True
+
+    # Knight jumps
+    for dx, dy in KNIGHT_OFFSETS:
+        if is_in_bounds(row + dx, col + dy) and board[row + dx][col + dy] == knight:
+            return True
+
+    # Adjacent king
+    for dx, dy in KING_OFFSETS:
+        if is_in_bounds(row + dx, col + dy) and board[row + dx][col + dy] == king:
+            return True
+
+    # Rays: the first piece met along each line is the only possible attacker
+    for directions, slider in ((ROOK_DIRECTIONS, rook), (BISHOP_DIRECTIONS, bishop)):
+        for dx, dy in directions:
+            x_new, y_new = row + dx, col + dy
+            while is_in_bounds(x_new, y_new):
+                piece = board[x_new][y_new]
+                if piece != '.':
+                    if piece == slider or piece == queen:
+                        return True
+                    break
+                x_new += dx
+                y_new += dy
     return False
 
-def simulate_move(board, start, end):
-    temp_board = [row.copy() for row in board]
+# Make a move in place and return the undo record needed to take it back
+def make_move(board, start, end):
     start_row, start_col = start
     end_row, end_col = end
-    piece = temp_board[start_row][start_col]
-    
-    # Handle pawn promotion in simulation
-    if piece in ['P', 'p']:
-        if (piece == 'P' and end_row == 0) or (piece == 'p' and end_row == 7):
-            piece = 'Q' if piece == 'P' else 'q'
-    
-    temp_board[end_row][end_col] = piece
-    temp_board[start_row][start_col] = '.'
-    return temp_board
+    piece = board[start_row][start_col]
+    captured = board[end_row][end_col]
+    promoted = (piece == 'P' and end_row == 0) or (piece == 'p' and end_row == 7)
+
+    board[end_row][end_col] = ('Q' if piece == 'P' else 'q') if promoted else piece
+    board[start_row][start_col] = '.'
+    return (start, end, piece, captured, promoted)
+
+# Restore the board to how it was before make_move
+def unmake_move(board, undo):
+    start, end, piece, captured, promoted = undo
+    board[start[0]][start[1]] = piece
+    board[end[0]][end[1]] = captured
 
 def find_king_position(board, color):
     king = 'K' if color == 'white' else 'k'
@@ -352,19 +428,10 @@ def find_king_position(board, color):
     return None
 
 def is_checkmate(board, color):
-    if not is_in_check(board, color):
-        return False
-    
-    for i in range(8):
-        for j in range(8):
-            piece = board[i][j]
-            if (color == 'white' and piece.isupper()) or (color == 'black' and piece.islower()):
-                moves = show_legal_moves(board, (i, j))
-                for move in moves:
-                    temp_board = simulate_move(board, (i, j), move)
-                    if not is_in_check(temp_board, color):
-                        return False
-    return True
+    return _position_cache.lookup(board, color).status == 'checkmate'
+
+def is_stalemate(board, color):
+    return _position_cache.lookup(board, color).status == 'stalemate'
 
 # Show legal moves for a piece
 def show_legal_moves(board, start):
@@ -486,7 +553,7 @@ def explain_difficulty():
     print("Difficulty levels:")
     print("  Easy: The AI makes random moves.")
     print("  Medium: The AI makes better moves but is still somewhat random.")
-    print("  Hard: The AI tries to make the best move based on piece evaluation.")
+    print("  Hard: The AI looks several moves ahead and picks the best line it finds.")
 
 # Validate the difficulty input
 def set_difficulty():
@@ -515,6 +582,9 @@ def ai_move(board):
 def game_loop():
     board = initialize_board()
     print("Welcome to Chess!")
+    profiler = profiling.enable_from_environment(sys.modules[__name__], PROFILED_FUNCTIONS)
+    # Cache hits and misses are reported per game in the profile
+    _position_cache.hits = _position_cache.misses = 0
     
     # Game statistics
     game_stats = {
@@ -545,11 +615,13 @@ def game_loop():
     ai_difficulty = None
     player_color = None
     memory = None
+    ponderer = None
     if mode == '1':
         ai_difficulty = set_difficulty()
         # Initialize AI memory for hard mode
         if ai_difficulty == 'hard':
             memory = GameMemory()
+            ponderer = get_ponderer()
         # Validate and echo color choice
         while True:
             color_choice = input("Choose your color (w/b): ").strip().lower()
@@ -585,6 +657,8 @@ def game_loop():
             if is_checkmate(board, current_turn):
                 winner = 'Black' if current_turn == 'white' else 'White'
                 result = f"{winner} wins by checkmate!"
+            elif is_stalemate(board, current_turn):
+                result = "Draw by stalemate!"
             else:
                 result = "Draw"
 
@@ -595,6 +669,12 @@ def game_loop():
             game_over = True
             break
 
+        # Check stalemate
+        if is_stalemate(board, current_turn):
+            print(f"\n*** STALEMATE! {current_turn.capitalize()} has no legal move; the game is drawn ***")
+            game_over = True
+            break
+
         # Check and announce checks
         check_status = []
         if is_in_check(board, 'white'):
@@ -609,8 +689,9 @@ def game_loop():
         # AI turn
         if mode == '1' and current_turn != player_color:
             print(f"\n{current_turn.capitalize()} AI's turn...")
-            time.sleep(1)
             
+            if profiler:
+                profiler.begin_move(game_stats['moves'] + 1, current_turn, ai_difficulty)
             valid_move_made = False
             for _ in range(3):  # Try 3 times to find valid move
                 move = None
@@ -619,13 +700,15 @@ def game_loop():
                 elif ai_difficulty == 'medium':
                     move = generate_medium_move(board, current_turn)
                 elif ai_difficulty == 'hard':
-                    move = generate_hard_move(board, current_turn, memory)
+                    move = generate_hard_move(board, current_turn, memory, ponderer=ponderer)
 
                 if move:
                     start, end = move
                     # Validate move doesn't leave AI in check
-                    temp_board = simulate_move(board, start, end)
-                    if not is_in_check(temp_board, current_turn):
+                    undo = make_move(board, start, end)
+                    leaves_check = is_in_check(board, current_turn)
+                    unmake_move(board, undo)
+                    if not leaves_check:
                         # Log the move
                         fen_before = board_to_fen(board, current_turn)
                         start_pos = coordinates_to_notation(*start)
@@ -652,6 +735,11 @@ def game_loop():
                         valid_move_made = True
                         break
                         
+            if profiler:
+                profiler.end_move()
+            if valid_move_made and ponderer is not None:
+                # Think about our next move while the human thinks about theirs
+                ponderer.start(board, player_color)
             if not valid_move_made:
                 winner = 'White' if current_turn == 'black' else 'Black'
                 print(f"\n{RED_COLOR}*** {winner} WINS! AI has no valid moves! ***{RESET_COLOR}")
@@ -692,7 +780,8 @@ def game_loop():
                     print("That's not your piece!")
                     continue
                 
-                legal_moves = show_legal_moves(board, (row, col))
+                legal_moves = [end for start, end in get_legal_moves(board, current_turn)
+                               if start == (row, col)]
                 if legal_moves:
                     print(f"Legal moves for {move_input.upper()}:")
                     for x, y in legal_moves:
@@ -724,10 +813,8 @@ def game_loop():
                 print(f"No {search_piece} found on the board")
                 continue
             
-            all_moves = []
-            for pos in positions:
-                moves = show_legal_moves(board, pos)
-                all_moves.extend([(pos, move) for move in moves])
+            all_moves = [(start, end) for start, end in get_legal_moves(board, current_turn)
+                         if start in positions]
             
             if not all_moves:
                 print(f"No legal moves available for {search_piece}")
@@ -764,8 +851,10 @@ def game_loop():
                 continue
                 
             # Check if move exposes king
-            temp_board = simulate_move(board, start, end)
-            if is_in_check(temp_board, current_turn):
+            undo = make_move(board, start, end)
+            exposes_king = is_in_check(board, current_turn)
+            unmake_move(board, undo)
+            if exposes_king:
                 print("Invalid move - would leave king in check!")
                 continue
                 
@@ -793,11 +882,14 @@ def game_loop():
                 print(f"Pawn promoted to {new_piece}!")
 
             game_stats['moves'] += 1
-            current_turn = 'black' if current_turn == 'white' else 'black'
+            current_turn = 'black' if current_turn == 'white' else 'white'
         
         except Exception as e:
             print(f"Invalid move: {str(e)}")
 
+    if ponderer is not None:
+        ponderer.stop()
+
     # Game over statistics
     print("\n=== Game Statistics ===")
     print(f"Total moves: {game_stats['moves']}")
@@ -808,8 +900,8 @@ def game_loop():
     print(f"Game duration: {time.time() - game_stats['start_time']:.1f} seconds")
     print_board(board)
     
-    # Save game log
-    result = check_for_win(board) or "Draw"
+    # Save game log; a checkmate or stalemate result was set at the top of the last turn
+    result = check_for_win(board) or result
     print(f"\nGame result: {result}")
     
     with open(game_filename, 'w') as f:
@@ -818,6 +910,21 @@ def game_loop():
         f.write(f"Result: {result}\n")
         f.write("\n".join(log_entries) + "\n")
 
+    # Learn from this game now rather than on the next full rebuild
+    if memory is None:
+        memory = GameMemory()
+    memory.record_game(game_filename)
+
+    if profiler:
+        game_stats['position_cache'] = {'hits': _position_cache.hits, 'misses': _position_cache.misses}
+        if _hard_search is not None:
+            stats = _hard_search.tt.stats()
+            if isinstance(_hard_search, ParallelSearch):
+                # Probes and stores are counted in the worker processes
+                stats = {name: stats[name] for name in ('size_mb', 'slots', 'usage')}
+            game_stats['transposition'] = stats
+        print(f"Profile saved to {profiler.dump(game_stats)}")
+
     # Update rating for Player vs AI games
     if mode == '1':
         if "wins" in result.lower():
@@ -0,0 +1,190 @@
+"""Static evaluation: material, piece-square tables and mobility.
+
+Scores are in centipawns. evaluate() scores one Position in plain Python and
+is what the search calls at its leaves. evaluate_batch() scores many
+positions at once as NumPy operations over an (N, 12, 64) array of piece
+planes and gives exactly the same numbers; NumPy is only needed for the
+batch path.
+
+Plane order follows position.PIECES ('PNBRQKpnbrqk') and squares follow the
+board lists (a8 is 0, h1 is 63). The material and piece-square tables live
+in piece_square.py; Position keeps running totals of them, so evaluate() only
+has mobility left to work out.
+
+Mobility is deliberately not one of the running totals. A move changes the
+attacks of every slider whose ray crosses its from or to square, so keeping
+it up to date means recounting those pieces in make_move and restoring them
+in unmake_move, at every node rather than only at the leaves. In Python that
+costs about as much as counting from scratch, which is what evaluate() does:
+around 40 microseconds in a middlegame, roughly half the search's time.
+
+    python evaluation.py chess_games/*.txt   # evaluation over each logged game
+"""
+import sys
+
+from piece_square import ENDGAME_SCORES, MAX_PHASE, MIDDLEGAME_SCORES, PHASE_WEIGHTS, PIECE_VALUES
+from position import BLACK, EMPTY, KNIGHT_ATTACKS, PIECES, WHITE, Position, bishop_attacks, \
+    iter_bits, popcount, queen_attacks, rook_attacks
+
+# Centipawns per square a piece attacks that is not held by its own side
+MOBILITY_WEIGHTS = {'N': 4, 'B': 5, 'R': 2, 'Q': 1}
+
+
+def taper(middlegame, endgame, phase):
+    phase = min(phase, MAX_PHASE)
+    return (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+MOBILITY_PIECES = [(piece, MOBILITY_WEIGHTS[piece.upper()]) for piece in 'NBRQnbrq']
+
+
+def mobility(position):
+    """White's mobility score minus Black's"""
+    score = 0
+    occupied = position.occupied
+    bitboards = position.bitboards
+    for piece, weight in MOBILITY_PIECES:
+        if piece.isupper():
+            own, sign = position.occupancy[WHITE], weight
+        else:
+            own, sign = position.occupancy[BLACK], -weight
+        kind = piece.upper()
+        for square in iter_bits(bitboards[piece]):
+            if kind == 'N':
+                attacks = KNIGHT_ATTACKS[square]
+            elif kind == 'B':
+                attacks = bishop_attacks(square, occupied)
+            elif kind == 'R':
+                attacks = rook_attacks(square, occupied)
+            else:
+                attacks = queen_attacks(square, occupied)
+            score += sign * popcount(attacks & ~own)
+    return score
+
+
+def evaluate_white(position):
+    """Score from White's point of view"""
+    return taper(position.middlegame, position.endgame, position.phase) + mobility(position)
+
+
+def evaluate(position):
+    """Score from the point of view of the side to move"""
+    score = evaluate_white(position)
+    return score if position.turn == WHITE else -score
+
+
+# Batch path
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("evaluate_batch needs NumPy: pip install numpy") from None
+    return numpy
+
+
+def position_planes(position, np=None):
+    """(12, 64) array with a 1 wherever each piece stands"""
+    np = np or _numpy()
+    planes = np.zeros((12, 64), dtype=np.int8)
+    for square, piece in enumerate(position.squares):
+        if piece != EMPTY:
+            planes[PIECES.index(piece), square] = 1
+    return planes
+
+
+def positions_to_planes(positions):
+    """(N, 12, 64) array for a list of positions"""
+    np = _numpy()
+    planes = np.zeros((len(positions), 12, 64), dtype=np.int8)
+    for index, position in enumerate(positions):
+        planes[index] = position_planes(position, np)
+    return planes
+
+
+def _shift(np, boards, dr, dc):
+    """Move every square of (N, 8, 8) boards by (dr, dc), dropping what falls off"""
+    shifted = np.zeros_like(boards)
+    shifted[:, max(dr, 0):8 + min(dr, 0), max(dc, 0):8 + min(dc, 0)] = \
+        boards[:, max(-dr, 0):8 + min(-dr, 0), max(-dc, 0):8 + min(-dc, 0)]
+    return shifted
+
+
+KNIGHT_DELTAS = [(-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (1, -2), (-1, 2), (1, 2)]
+STRAIGHT_DELTAS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+DIAGONAL_DELTAS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+
+def _batch_mobility(np, boards):
+    """Mobility for (N, 12, 8, 8) boards, matching mobility() position by position"""
+    white = boards[:, :6].sum(axis=1)
+    black = boards[:, 6:].sum(axis=1)
+    empty = 1 - white - black
+    score = np.zeros(len(boards), dtype=np.int64)
+    for offset, own, sign in ((0, white, 1), (6, black, -1)):
+        # Weighted attack counts per target square; own pieces are masked off
+        # once at the end since the mask does not depend on the attacker
+        attacks = np.zeros_like(own)
+        knights = boards[:, offset + 1] * MOBILITY_WEIGHTS['N']
+        for dr, dc in KNIGHT_DELTAS:
+            attacks += _shift(np, knights, dr, dc)
+        queens = boards[:, offset + 4] * MOBILITY_WEIGHTS['Q']
+        diagonal = boards[:, offset + 2] * MOBILITY_WEIGHTS['B'] + queens
+        straight = boards[:, offset + 3] * MOBILITY_WEIGHTS['R'] + queens
+        # Walk each ray a step at a time; a ray only carries on past empty squares
+        for sliders, deltas in ((diagonal, DIAGONAL_DELTAS), (straight, STRAIGHT_DELTAS)):
+            for dr, dc in deltas:
+                ray = _shift(np, sliders, dr, dc)
+                while ray.any():
+                    attacks += ray
+                    ray = _shift(np, ray * empty, dr, dc)
+        score += sign * (attacks * (1 - own)).sum(axis=(1, 2))
+    return score
+
+
+def evaluate_batch(planes, white_to_move=None):
+    """Score an (N, 12, 64) batch of piece planes in one go.
+
+    Scores are from White's point of view, or from the side to move's if
+    white_to_move (a length-N sequence of booleans) is given.
+    """
+    np = _numpy()
+    planes = np.asarray(planes, dtype=np.int64)
+    middlegame_table = np.array([MIDDLEGAME_SCORES[piece] for piece in PIECES], dtype=np.int64)
+    endgame_table = np.array([ENDGAME_SCORES[piece] for piece in PIECES], dtype=np.int64)
+    phase_weights = np.array([PHASE_WEIGHTS[piece.upper()] for piece in PIECES], dtype=np.int64)
+
+    middlegame = np.einsum('npk,pk->n', planes, middlegame_table)
+    endgame = np.einsum('npk,pk->n', planes, endgame_table)
+    phase = np.minimum(planes.sum(axis=2) @ phase_weights, MAX_PHASE)
+    scores = (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+    scores += _batch_mobility(np, planes.reshape(len(planes), 12, 8, 8))
+    if white_to_move is not None:
+        scores = np.where(np.asarray(white_to_move, dtype=bool), scores, -scores)
+    return scores
+
+
+def evaluate_positions(positions):
+    """White's-view scores for a list of positions, batched when NumPy is available"""
+    try:
+        return [int(score) for score in evaluate_batch(positions_to_planes(positions))]
+    except ImportError:
+        return [evaluate_white(position) for position in positions]
+
+
+def main(argv=None):
+    from game_logs import read_game_log
+
+    filenames = sys.argv[1:] if argv is None else argv
+    for filename in filenames:
+        result, moves = read_game_log(filename)
+        positions = [Position.from_fen(fen) for fen, _ in moves]
+        if not positions:
+            continue
+        scores = evaluate_positions(positions)
+        print(f"{filename}: {result}, {len(scores)} positions, final {scores[-1]:+d}, "
+              f"best for White {max(scores):+d}, best for Black {min(scores):+d}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
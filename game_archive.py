@@ -0,0 +1,207 @@
+"""Compact binary archive of games, read as a stream.
+
+The text logs spend 60-odd bytes per ply on the FEN before every move. An
+archive keeps only what is needed to replay each game: a file header, then
+one record per game
+
+    flags (1 byte) | result length (1 byte) | plies (2 bytes)
+    result text
+    start FEN, as a length byte and text, only if the START_FEN flag is set
+    plies x 2-byte moves (from | to << 6 | promotion << 12, as in position.py)
+
+Games are written one after another, so archives can be appended to and read
+a game at a time without loading the whole file. Positions are rebuilt by
+replaying the moves.
+
+    python game_archive.py convert chess_games/*.txt -o chess_games/games.cga
+    python game_archive.py stats chess_games/games.cga
+"""
+import argparse
+import os
+import struct
+import sys
+from array import array
+
+from game_logs import read_game_log
+from opening_book import encode_log_move
+from position import EMPTY, PROMOTION_PIECES, Position, move_to_uci, play_log_move
+
+MAGIC = b'CGA1'
+GAME_HEADER = struct.Struct('<BBH')
+FLAG_START_FEN = 1
+
+# The position every game_loop log starts from, in the logs' FEN layout
+LOG_START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w'
+
+
+class ArchivedGame:
+    __slots__ = ('result', 'start_fen', 'moves')
+
+    def __init__(self, result, moves, start_fen=LOG_START_FEN):
+        self.result = result
+        self.start_fen = start_fen
+        self.moves = moves  # array('H') of packed moves
+
+    def __len__(self):
+        return len(self.moves)
+
+    def positions(self):
+        """Yield (position, move) before each ply, replaying from the start.
+
+        The same Position object is updated in place between items, so copy
+        it to keep one. Like the console game there is no en passant, so
+        hashes match Position.from_fen on the text logs' FENs.
+        """
+        position = Position.from_fen(self.start_fen)
+        for move in self.moves:
+            yield position, move
+            play_log_move(position, move)
+
+
+def write_game(f, game):
+    result = (game.result or '').encode()[:255]
+    flags = FLAG_START_FEN if game.start_fen != LOG_START_FEN else 0
+    f.write(GAME_HEADER.pack(flags, len(result), len(game.moves)))
+    f.write(result)
+    if flags & FLAG_START_FEN:
+        fen = game.start_fen.encode()
+        f.write(bytes([len(fen)]) + fen)
+    f.write(game.moves.tobytes() if sys.byteorder == 'little' else _swapped(game.moves).tobytes())
+
+
+def _swapped(moves):
+    moves = array('H', moves)
+    moves.byteswap()
+    return moves
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated game archive")
+    return data
+
+
+def iter_archive(path):
+    """Yield the games in an archive one at a time"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a game archive")
+        while True:
+            header = f.read(GAME_HEADER.size)
+            if not header:
+                break
+            if len(header) != GAME_HEADER.size:
+                raise ValueError("Truncated game archive")
+            flags, result_length, plies = GAME_HEADER.unpack(header)
+            result = _read_exact(f, result_length).decode() or None
+            start_fen = LOG_START_FEN
+            if flags & FLAG_START_FEN:
+                start_fen = _read_exact(f, _read_exact(f, 1)[0]).decode()
+            moves = array('H', _read_exact(f, plies * 2))
+            if sys.byteorder != 'little':
+                moves.byteswap()
+            yield ArchivedGame(result, moves, start_fen)
+
+
+def open_archive(path, append=True):
+    """Open an archive for writing games, starting a new file if needed"""
+    if append and os.path.exists(path) and os.path.getsize(path) > 0:
+        return open(path, 'ab')
+    f = open(path, 'wb')
+    f.write(MAGIC)
+    return f
+
+
+def game_from_log(filename):
+    """Turn a text log into an ArchivedGame.
+
+    Each move is replayed and checked against the next logged FEN; the
+    game is cut short at the first ply that does not match, since the log
+    can't be trusted past it. Promotions are read off the next FEN.
+    """
+    result, logged = read_game_log(filename)
+    if not logged:
+        return ArchivedGame(result, array('H'))
+    start_fen = logged[0][0]
+    position = Position.from_fen(start_fen)
+    moves = array('H')
+    for ply, (fen, text) in enumerate(logged):
+        if position.to_fen() != fen:
+            print(f"{filename}: position before move {ply + 1} doesn't follow from the moves, "
+                  f"keeping the first {ply}")
+            break
+        try:
+            move = encode_log_move(text)
+        except ValueError as e:
+            print(f"{filename}: stopping at move {ply + 1} ({text!r}): {e}")
+            break
+        move = _with_promotion(position, move, logged[ply + 1][0] if ply + 1 < len(logged) else None)
+        moves.append(move)
+        play_log_move(position, move)
+    return ArchivedGame(result, moves, start_fen)
+
+
+def _with_promotion(position, move, next_fen):
+    start = move & 63
+    end = (move >> 6) & 63
+    piece = position.squares[start]
+    if piece not in 'Pp' or end >> 3 not in (0, 7):
+        return move
+    promoted = 'Q'
+    if next_fen is not None:
+        landed = Position.from_fen(next_fen).squares[end]
+        if landed != EMPTY and landed.upper() in PROMOTION_PIECES[1:]:
+            promoted = landed.upper()
+    return move | (PROMOTION_PIECES.index(promoted) << 12)
+
+
+def convert_logs(log_files, archive_path, append=True):
+    """Append text logs to an archive; returns (games, plies, text bytes)"""
+    games = plies = text_bytes = 0
+    with open_archive(archive_path, append) as f:
+        for filename in log_files:
+            try:
+                game = game_from_log(filename)
+                text_bytes += os.path.getsize(filename)
+            except OSError as e:
+                print(f"Skipping {filename}: {e}")
+                continue
+            write_game(f, game)
+            games += 1
+            plies += len(game)
+    return games, plies, text_bytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert game logs to a compact binary archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="add text logs to an archive")
+    convert.add_argument("logs", nargs='+')
+    convert.add_argument("-o", "--output", default="chess_games/games.cga")
+    convert.add_argument("--overwrite", action="store_true", help="start a new archive instead of appending")
+    stats = commands.add_parser("stats", help="summarize an archive")
+    stats.add_argument("archive")
+    stats.add_argument("--moves", action="store_true", help="print each game's moves")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        games, plies, text_bytes = convert_logs(args.logs, args.output, not args.overwrite)
+        size = os.path.getsize(args.output)
+        print(f"Archived {games} game(s), {plies} plies into {args.output} ({size} bytes; "
+              f"the logs were {text_bytes} bytes)")
+    else:
+        games = plies = 0
+        for game in iter_archive(args.archive):
+            games += 1
+            plies += len(game)
+            if args.moves:
+                print(f"{game.result}: {' '.join(move_to_uci(move) for move in game.moves)}")
+        size = os.path.getsize(args.archive)
+        print(f"{args.archive}: {games} game(s), {plies} plies, {size} bytes "
+              f"({size / plies if plies else 0:.1f} bytes per ply)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
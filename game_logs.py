@@ -0,0 +1,52 @@
+"""Reading the chess_games/*.txt logs written by game_loop.
+
+A log starts with a few "Key: value" header lines (Players, Difficulty,
+Result) followed by one "Move:<fen before the move>:<move>" line per ply.
+"""
+import glob
+
+GAME_LOG_PATTERN = "chess_games/*.txt"
+
+
+def list_game_logs(pattern=GAME_LOG_PATTERN):
+    return sorted(glob.glob(pattern))
+
+
+def normalize_move(move):
+    """Clean up a logged move the same way notation_to_coordinates does"""
+    move = move.lower().replace("-", "").replace(" ", "")
+    if len(move) != 4:
+        raise ValueError(f"Invalid move notation: {move!r}")
+    return move
+
+
+def white_outcome(result):
+    if "White wins" in result:
+        return 'win'
+    if "Black wins" in result:
+        return 'loss'
+    return 'draw'
+
+
+def outcome_for(side, outcome):
+    """Turn white's outcome into the outcome for side ('w' or 'b')"""
+    if side == 'w' or outcome == 'draw':
+        return outcome
+    return 'loss' if outcome == 'win' else 'win'
+
+
+def read_game_log(filename):
+    """Return (result, [(fen_before, move), ...]) for a log file"""
+    result = None
+    moves = []
+    with open(filename, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if line.startswith("Result:"):
+                result = line.split(":", 1)[1].strip()
+            elif line.startswith("Move:"):
+                fields = line.strip().split(":", 2)
+                if len(fields) != 3:
+                    print(f"{filename}:{line_number}: skipping malformed move line")
+                    continue
+                moves.append((fields[1], fields[2]))
+    return result, moves
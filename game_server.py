@@ -0,0 +1,322 @@
+"""Asyncio server hosting many concurrent games against the AI.
+
+Clients connect over TCP (or a Unix socket with --unix) and exchange one JSON
+object per line. A connection can run any number of games. Moves are checked
+with the same helpers the console game uses, and every AI move is worked out
+on a bounded process pool so the event loop never waits on a search.
+
+    python game_server.py --port 8765 --workers 4
+    python game_server.py --unix /tmp/chess.sock --log-dir chess_games
+
+Requests:
+
+    {"cmd": "new", "difficulty": "hard", "color": "white"}
+    {"cmd": "move", "game": 1, "move": "e2e4"}          (optional "promotion": "N")
+    {"cmd": "legal", "game": 1}
+    {"cmd": "state", "game": 1}
+    {"cmd": "resign", "game": 1}
+
+Replies carry a "type" of started, move, legal, state, over or error, plus the
+game's id, board (in the game log FEN layout), turn and result once it ends.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import itertools
+import json
+import os
+import sys
+from array import array
+
+from console_chess_ai import GameMemory, board_to_fen, coordinates_to_notation, generate_hard_move, \
+    generate_medium_move, generate_random_move, get_legal_moves, initialize_board, is_in_check, \
+    move_piece, notation_to_coordinates, parse_fen
+from position import PROMOTION_PIECES, coordinates_to_move, move_promotion, move_to_coordinates, move_to_uci
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+PROMOTION_CHOICES = ('Q', 'R', 'B', 'N')
+MAX_LINE_BYTES = 4096
+
+# Set up once per worker process by _init_worker
+_worker_memory = None
+
+
+def _init_worker(use_book):
+    global _worker_memory
+    _worker_memory = GameMemory() if use_book else None
+
+
+def engine_move(task):
+    """Worker: the AI's move for a board, packed as in position.py, or None"""
+    difficulty, fen, color, movetime = task
+    board = parse_fen(fen)
+    if difficulty == 'easy':
+        move = generate_random_move(board, color)
+    elif difficulty == 'medium':
+        move = generate_medium_move(board, color)
+    else:
+        move = generate_hard_move(board, color, _worker_memory, time_limit=movetime, silent=True)
+    if not move:
+        return None
+    return coordinates_to_move(*move)
+
+
+def move_notation(move):
+    """'e2e4', or 'e7e8Q' for a promotion, as the protocol reports moves"""
+    notation = move_to_uci(move)
+    return notation[:4] + notation[4:].upper()
+
+
+class GameSession:
+    """One game's state. The board is kept as its FEN string and moves as
+    packed 16-bit ints so thousands of idle games cost little memory.
+    """
+    __slots__ = ('id', 'difficulty', 'player_color', 'fen', 'moves', 'result', 'started')
+
+    def __init__(self, game_id, difficulty, player_color):
+        self.id = game_id
+        self.difficulty = difficulty
+        self.player_color = player_color
+        self.fen = board_to_fen(initialize_board(), 'white')
+        self.moves = array('H')
+        self.result = None
+        self.started = datetime.datetime.now()
+
+    @property
+    def turn(self):
+        return 'white' if self.fen.endswith('w') else 'black'
+
+    @property
+    def board(self):
+        return parse_fen(self.fen)
+
+    def play(self, move, promotion='Q'):
+        """Play a packed move already checked to be legal and update the result"""
+        board = self.board
+        turn = self.turn
+        start, end = move_to_coordinates(move)
+        piece = board[start[0]][start[1]]
+        move_piece(board, start, end, silent=True)
+        if piece in 'Pp' and end[0] in (0, 7):
+            board[end[0]][end[1]] = promotion if piece == 'P' else promotion.lower()
+            move = (move & 0xFFF) | (PROMOTION_PIECES.index(promotion) << 12)
+        self.moves.append(move)
+        opponent = 'black' if turn == 'white' else 'white'
+        self.fen = board_to_fen(board, opponent)
+        if not get_legal_moves(board, opponent):
+            if is_in_check(board, opponent):
+                self.result = f"{turn.capitalize()} wins by checkmate!"
+            else:
+                self.result = "Draw"
+        return move_notation(move)
+
+    def state(self, kind, **extra):
+        message = {'type': kind, 'game': self.id, 'board': self.fen, 'turn': self.turn}
+        if self.result:
+            message['result'] = self.result
+        message.update(extra)
+        return message
+
+    def log_lines(self):
+        """The game in game_loop's log format, rebuilt by replaying the moves"""
+        board = initialize_board()
+        turn = 'white'
+        lines = []
+        for move in self.moves:
+            start, end = move_to_coordinates(move)
+            lines.append(f"Move:{board_to_fen(board, turn)}:{move_to_uci(move)[:4]}")
+            piece = board[start[0]][start[1]]
+            move_piece(board, start, end, silent=True)
+            if move_promotion(move):
+                promoted = PROMOTION_PIECES[move_promotion(move)]
+                board[end[0]][end[1]] = promoted if piece == 'P' else promoted.lower()
+            turn = 'black' if turn == 'white' else 'white'
+        return lines
+
+
+class GameServer:
+    def __init__(self, workers=None, movetime=1.0, max_games=10000, use_book=True, log_dir=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.movetime = movetime
+        self.max_games = max_games
+        self.log_dir = log_dir
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                           initargs=(use_book,))
+        # Caps the searches handed to the pool; the rest wait their turn here
+        # rather than piling up in the pool's queue
+        self.pool_slots = None
+        self.sessions = {}
+        self.game_ids = itertools.count(1)
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_path=None):
+        self.pool_slots = asyncio.Semaphore(self.workers)
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_client, unix_path, limit=MAX_LINE_BYTES)
+            print(f"Serving games on {unix_path} with {self.workers} engine worker(s)")
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port, limit=MAX_LINE_BYTES)
+            print(f"Serving games on {host}:{port} with {self.workers} engine worker(s)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def handle_client(self, reader, writer):
+        owned = set()
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await self.send(writer, {'type': 'error', 'message': "Line too long"})
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Requests must be JSON objects")
+                except ValueError as e:
+                    await self.send(writer, {'type': 'error', 'message': f"Invalid request: {e}"})
+                    continue
+                try:
+                    reply, session = self.handle_request(request, owned)
+                except Exception as e:
+                    # One bad request must not drop the connection and its games
+                    reply, session = {'type': 'error', 'message': f"Request failed: {e}"}, None
+                await self.send(writer, reply)
+                # The AI answers in the background so this connection's other
+                # games keep being served meanwhile
+                if session is not None and session.result is None and session.turn != session.player_color:
+                    task = asyncio.ensure_future(self.reply_with_ai_move(session, writer))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            for game_id in owned:
+                self.sessions.pop(game_id, None)
+            writer.close()
+
+    def handle_request(self, request, owned):
+        """Reply to one request; also returns the session if the AI may be due to move"""
+        command = request.get('cmd')
+        if command == 'new':
+            return self.new_game(request, owned)
+
+        game_id = request.get('game')
+        session = self.sessions.get(game_id) if isinstance(game_id, int) else None
+        if session is None or session.id not in owned:
+            return {'type': 'error', 'message': "Unknown game"}, None
+        if command == 'state':
+            return session.state('state'), None
+        if command == 'legal':
+            moves = [coordinates_to_notation(*start) + coordinates_to_notation(*end)
+                     for start, end in get_legal_moves(session.board, session.turn)]
+            return session.state('legal', moves=moves if session.result is None else []), None
+        if command == 'resign':
+            if session.result is None:
+                winner = 'Black' if session.player_color == 'white' else 'White'
+                session.result = f"{winner} wins by resignation!"
+                self.finish(session)
+            return session.state('over'), None
+        if command == 'move':
+            return self.player_move(session, request)
+        return {'type': 'error', 'game': session.id, 'message': f"Unknown command: {command}"}, None
+
+    def new_game(self, request, owned):
+        difficulty = request.get('difficulty', 'medium')
+        color = request.get('color', 'white')
+        if difficulty not in DIFFICULTIES:
+            return {'type': 'error', 'message': "Difficulty must be easy, medium or hard"}, None
+        if color not in ('white', 'black'):
+            return {'type': 'error', 'message': "Color must be white or black"}, None
+        if len(self.sessions) >= self.max_games:
+            return {'type': 'error', 'message': "Server is full, try again later"}, None
+        session = GameSession(next(self.game_ids), difficulty, color)
+        self.sessions[session.id] = session
+        owned.add(session.id)
+        return session.state('started', color=color, difficulty=difficulty), session
+
+    def player_move(self, session, request):
+        if session.result is not None:
+            return session.state('error', message="Game is over"), None
+        if session.turn != session.player_color:
+            return session.state('error', message="Not your turn"), None
+        try:
+            start, end = notation_to_coordinates(str(request.get('move', '')))
+        except (ValueError, IndexError) as e:
+            return session.state('error', message=f"Invalid move: {e}"), None
+        promotion = str(request.get('promotion', 'Q')).upper()
+        if promotion not in PROMOTION_CHOICES:
+            return session.state('error', message="Promotion must be one of Q, R, B, N"), None
+        if (start, end) not in get_legal_moves(session.board, session.turn):
+            return session.state('error', message="Illegal move"), None
+        notation = session.play(coordinates_to_move(start, end), promotion)
+        if session.result is not None:
+            self.finish(session)
+        return session.state('move', by='player', move=notation), session
+
+    async def reply_with_ai_move(self, session, writer):
+        task = (session.difficulty, session.fen, session.turn, self.movetime)
+        async with self.pool_slots:
+            move = await asyncio.get_running_loop().run_in_executor(self.pool, engine_move, task)
+        if session.result is not None or self.sessions.get(session.id) is not session:
+            return  # Resigned or disconnected while the AI was thinking
+        notation = None
+        if move is None:
+            session.result = "Draw"
+        else:
+            notation = session.play(move)
+        if session.result is not None:
+            self.finish(session)
+        try:
+            await self.send(writer, session.state('move', by='ai', move=notation))
+        except ConnectionError:
+            pass
+
+    def finish(self, session):
+        """Save the finished game in game_loop's log format so the book can learn from it"""
+        if not self.log_dir:
+            return
+        os.makedirs(self.log_dir, exist_ok=True)
+        timestamp = session.started.strftime("%Y%m%d_%H%M%S")
+        filename = os.path.join(self.log_dir, f"game_{timestamp}_server{session.id:06d}.txt")
+        with open(filename, 'w') as f:
+            f.write("Players: Player vs AI\n")
+            f.write(f"Difficulty: {session.difficulty.capitalize()}\n")
+            f.write(f"Result: {session.result}\n")
+            f.write("\n".join(session.log_lines()) + "\n")
+
+    async def send(self, writer, message):
+        writer.write((json.dumps(message) + "\n").encode())
+        await writer.drain()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many chess games over line-delimited JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--workers", type=int, default=None, help="engine processes (default: all cores)")
+    parser.add_argument("--movetime", type=float, default=1.0, help="seconds per hard-mode move")
+    parser.add_argument("--max-games", type=int, default=10000, help="refuse new games beyond this many")
+    parser.add_argument("--no-book", action="store_true", help="don't let hard mode use the opening book")
+    parser.add_argument("--log-dir", default=None, help="save finished games here in game_loop's log format")
+    args = parser.parse_args(argv)
+
+    server = GameServer(args.workers, args.movetime, args.max_games, not args.no_book, args.log_dir)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
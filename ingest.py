@@ -0,0 +1,150 @@
+"""Bulk ingestion of game logs into the opening book on a process pool.
+
+The list of new or changed logs is split into shards. Each worker reads its
+shard into a partial position -> move -> stats table, writes what every log
+contributed to its own ledger chunk, and spills the table to a sorted run
+file whenever it reaches --spill-records entries. The reduce step appends the
+ledger chunks, records the logs in the manifest and stream-merges the runs
+with the existing book, so memory stays bounded however large the archive is.
+
+    python ingest.py --workers 8
+    python ingest.py chess_games/games.cga --workers 8
+    python ingest.py --workers 8 --spill-records 100000 --rebuild
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from game_logs import list_game_logs
+from opening_book import BOOK_PATH, LEDGER_RECORD, OpeningBook, apply_records, companion_path, \
+    game_records, manifest_line, merge_books, pending_logs, read_ledger, read_manifest, \
+    remove_book_files, write_book
+
+
+def ingest_shard(task):
+    """Worker: read one shard of logs into spilled runs and a ledger chunk"""
+    shard_index, filenames, work_dir, spill_records = task
+    ledger_path = os.path.join(work_dir, f"shard_{shard_index}.ledger")
+    runs = []
+    logs = []
+    plies = 0
+    stats = {}
+    with open(ledger_path, 'wb') as ledger:
+        for filename, size, mtime_ns in filenames:
+            try:
+                records = game_records(filename)
+            except OSError as e:
+                print(f"Skipping {filename}: {e}")
+                continue
+            apply_records(stats, records)
+            for record in records:
+                ledger.write(LEDGER_RECORD.pack(*record))
+            logs.append((filename, size, mtime_ns, len(records)))
+            plies += len(records)
+            if len(stats) >= spill_records:
+                runs.append(_spill(stats, work_dir, shard_index, len(runs)))
+                stats = {}
+    if stats:
+        runs.append(_spill(stats, work_dir, shard_index, len(runs)))
+    return shard_index, logs, ledger_path, runs, plies
+
+
+def _spill(stats, work_dir, shard_index, run_index):
+    path = os.path.join(work_dir, f"shard_{shard_index}_run_{run_index}.bin")
+    write_book(path, stats)
+    return path
+
+
+def bulk_update_book(book_path=BOOK_PATH, log_files=None, workers=None, shard_size=1000,
+                     spill_records=250000, rebuild=False):
+    """Fold new and changed logs into the book in parallel; returns a summary dict"""
+    started = time.perf_counter()
+    if log_files is None:
+        log_files = list_game_logs()
+    if rebuild:
+        remove_book_files(book_path)
+    ledger_path = companion_path(book_path, '.ledger')
+    manifest_path = companion_path(book_path, '.manifest')
+
+    pending = pending_logs(log_files, read_manifest(manifest_path))
+    summary = {'games': 0, 'plies': 0, 'seconds': 0.0, 'records': 0}
+    if not pending:
+        return summary
+
+    work_dir = tempfile.mkdtemp(prefix="ingest_", dir=os.path.dirname(book_path) or ".")
+    try:
+        runs = []
+        # Logs that changed since they were counted have their old counts
+        # taken back out through a run of negative records
+        removed = {}
+        for filename, info, known in pending:
+            if known is not None:
+                apply_records(removed, read_ledger(ledger_path, known[2], known[3]), -1)
+        if removed:
+            runs.append(_spill(removed, work_dir, 'removed', 0))
+
+        entries = [(filename, info.st_size, info.st_mtime_ns) for filename, info, known in pending]
+        tasks = [(index, entries[start:start + shard_size], work_dir, spill_records)
+                 for index, start in enumerate(range(0, len(entries), shard_size))]
+        results = [None] * len(tasks)
+        games = plies = 0
+        with multiprocessing.Pool(workers) as pool:
+            for done, result in enumerate(pool.imap_unordered(ingest_shard, tasks), 1):
+                results[result[0]] = result
+                games += len(result[1])
+                plies += result[4]
+                elapsed = time.perf_counter() - started
+                print(f"[{done}/{len(tasks)} shards] {games}/{len(entries)} games, "
+                      f"{games / elapsed:.0f} games/s, {plies / elapsed:.0f} plies/s")
+
+        # Reduce: ledger chunks and manifest in shard order, then merge the runs
+        ledger_offset = os.path.getsize(ledger_path) if os.path.exists(ledger_path) else 0
+        with open(ledger_path, 'ab') as ledger, open(manifest_path, 'a') as manifest_out:
+            for shard_index, logs, chunk_path, shard_runs, shard_plies in results:
+                with open(chunk_path, 'rb') as chunk:
+                    shutil.copyfileobj(chunk, ledger)
+                for filename, size, mtime_ns, record_count in logs:
+                    manifest_out.write(manifest_line(filename, size, mtime_ns, ledger_offset, record_count))
+                    ledger_offset += record_count * LEDGER_RECORD.size
+                runs.extend(shard_runs)
+
+        delta_path = companion_path(book_path, '.delta')
+        summary['records'] = merge_books([book_path, delta_path] + runs, book_path)
+        if os.path.exists(delta_path):
+            os.remove(delta_path)
+        summary['games'] = games
+        summary['plies'] = plies
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    summary['seconds'] = time.perf_counter() - started
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest game logs into the opening book in parallel")
+    parser.add_argument("sources", nargs='*', help="game logs or .cga archives (default: chess_games/*.txt)")
+    parser.add_argument("--book", default=BOOK_PATH)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--shard-size", type=int, default=1000, help="logs per worker task")
+    parser.add_argument("--spill-records", type=int, default=250000,
+                        help="spill a worker's partial table to disk at this many entries")
+    parser.add_argument("--rebuild", action="store_true", help="start over from every log")
+    args = parser.parse_args(argv)
+
+    summary = bulk_update_book(args.book, args.sources or None, workers=args.workers,
+                               shard_size=args.shard_size, spill_records=args.spill_records,
+                               rebuild=args.rebuild)
+    seconds = max(summary['seconds'], 1e-9)
+    book = OpeningBook(args.book)
+    print(f"Ingested {summary['games']} game(s), {summary['plies']} plies in {seconds:.1f}s "
+          f"({summary['games'] / seconds:.0f} games/s); {len(book)} book entries")
+    book.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
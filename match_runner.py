@@ -0,0 +1,264 @@
+"""Headless engine-vs-engine matches on a process pool.
+
+Plays the AI move generators against each other without prompts, sleeps or
+board printing, N games at a time. Games come in pairs that share a random
+opening with colors swapped, so neither engine profits from a lucky start.
+
+    python match_runner.py hard medium --games 100 --workers 8 --movetime 0.2
+    python match_runner.py hard easy --games 20 --log-dir chess_games
+
+Engines are 'easy', 'medium', 'hard' or 'module:function' for any function
+taking (board, color) and returning a (start, end) move. With --log-dir the
+games are saved in the same format as game_loop so they can be learned from.
+"""
+import argparse
+import datetime
+import importlib
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from console_chess_ai import GameMemory, board_to_fen, coordinates_to_notation, \
+    generate_hard_move, generate_medium_move, generate_random_move, get_legal_moves, \
+    initialize_board, is_in_check, move_piece
+
+MAX_PLIES = 300
+
+# Set up once per worker process by _init_worker
+_worker_memory = None
+
+
+def _init_worker(use_book):
+    global _worker_memory
+    _worker_memory = GameMemory() if use_book else None
+
+
+def load_engine(name, movetime):
+    """Return a move function taking (board, color)"""
+    if name == 'easy':
+        return generate_random_move
+    if name == 'medium':
+        return generate_medium_move
+    if name == 'hard':
+        return lambda board, color: generate_hard_move(board, color, _worker_memory,
+                                                       time_limit=movetime, silent=True)
+    if ':' in name:
+        module_name, function_name = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), function_name)
+    raise ValueError(f"Unknown engine: {name}")
+
+
+def play_random_opening(board, plies, rng):
+    """Play plies random legal moves; returns the log lines and side to move"""
+    turn = 'white'
+    log = []
+    for _ in range(plies):
+        moves = get_legal_moves(board, turn)
+        if not moves:
+            break
+        start, end = rng.choice(moves)
+        log.append(f"Move:{board_to_fen(board, turn)}:"
+                   f"{coordinates_to_notation(*start)}{coordinates_to_notation(*end)}")
+        move_piece(board, start, end, silent=True)
+        turn = 'black' if turn == 'white' else 'white'
+    return log, turn
+
+
+def only_kings_left(board):
+    return all(piece in '.Kk' for row in board for piece in row)
+
+
+def play_game(task):
+    """Worker: play one game and return its result record"""
+    game_index, white_name, black_name, opening_seed, opening_plies, movetime = task
+    engines = {'white': load_engine(white_name, movetime), 'black': load_engine(black_name, movetime)}
+    think_time = {'white': 0.0, 'black': 0.0}
+
+    board = initialize_board()
+    log, turn = play_random_opening(board, opening_plies, random.Random(opening_seed))
+    seen = {}
+    halfmove_clock = 0
+    result = reason = None
+    for _ in range(MAX_PLIES):
+        fen = board_to_fen(board, turn)
+        seen[fen] = seen.get(fen, 0) + 1
+        legal_moves = get_legal_moves(board, turn)
+        winner = 'Black' if turn == 'white' else 'White'
+        if not legal_moves:
+            if is_in_check(board, turn):
+                result, reason = f"{winner} wins by checkmate!", 'checkmate'
+            else:
+                result, reason = "Draw", 'stalemate'
+            break
+        if seen[fen] >= 3:
+            result, reason = "Draw", 'repetition'
+            break
+        if halfmove_clock >= 100:
+            result, reason = "Draw", 'fifty moves'
+            break
+        if only_kings_left(board):
+            result, reason = "Draw", 'insufficient material'
+            break
+
+        started = time.perf_counter()
+        move = engines[turn](board, turn)
+        think_time[turn] += time.perf_counter() - started
+        if move not in legal_moves:
+            result, reason = f"{winner} wins by illegal move!", 'illegal move'
+            break
+
+        start, end = move
+        piece = board[start[0]][start[1]]
+        capture = board[end[0]][end[1]] != '.'
+        log.append(f"Move:{fen}:{coordinates_to_notation(*start)}{coordinates_to_notation(*end)}")
+        move_piece(board, start, end, silent=True)
+        halfmove_clock = 0 if capture or piece in 'Pp' else halfmove_clock + 1
+        turn = 'black' if turn == 'white' else 'white'
+    else:
+        result, reason = "Draw", 'move limit'
+
+    return {
+        'game': game_index,
+        'white': white_name,
+        'black': black_name,
+        'result': result,
+        'reason': reason,
+        'plies': len(log),
+        'think_time': think_time,
+        'log': log,
+    }
+
+
+# Elo for a score of exactly 0 or 1 is infinite; report this instead
+ELO_CLAMP = 2400
+
+
+def elo_difference(wins, draws, losses):
+    """Elo difference and 95% interval (low, high) from the first engine's view.
+
+    When every game had the same result the sample has no variance to build
+    an interval from, so the interval is (-inf, inf); a clean sweep's Elo is
+    then only the +-ELO_CLAMP clamp, not an estimate.
+    """
+    games = wins + draws + losses
+    if not games:
+        return 0.0, -math.inf, math.inf
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if not variance:
+        return to_elo(score), -math.inf, math.inf
+    margin = 1.96 * math.sqrt(variance / games)
+    return to_elo(score), to_elo(score - margin), to_elo(score + margin)
+
+
+def to_elo(score):
+    if score <= 0:
+        return -ELO_CLAMP
+    if score >= 1:
+        return ELO_CLAMP
+    return max(-ELO_CLAMP, min(ELO_CLAMP, -400 * math.log10(1 / score - 1))) + 0.0
+
+
+def format_elo(elo, low, high):
+    """Elo difference and interval for the report, marking clamped values as such"""
+    if abs(elo) >= ELO_CLAMP:
+        text = f"{elo:+.0f} (a clamp: one engine scored nothing, so the real difference is unbounded)"
+    else:
+        text = f"{elo:+.0f}"
+    if math.isinf(low) or math.isinf(high):
+        return text + " (95% interval undefined: every game had the same result)"
+    low_text = "unbounded" if low <= -ELO_CLAMP else f"{low:+.0f}"
+    high_text = "unbounded" if high >= ELO_CLAMP else f"{high:+.0f}"
+    return text + f" (95% interval {low_text} to {high_text})"
+
+
+def save_game_log(record, log_dir):
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = os.path.join(log_dir, f"game_{timestamp}_match{record['game']:05d}.txt")
+    with open(filename, 'w') as f:
+        f.write("Players: Engine vs Engine\n")
+        f.write(f"Difficulty: {record['white']} vs {record['black']}\n")
+        f.write(f"Result: {record['result']}\n")
+        f.write("\n".join(record['log']) + "\n")
+    return filename
+
+
+def run_match(engine1, engine2, games=10, workers=None, movetime=0.1, opening_plies=4,
+              seed=None, use_book=False, log_dir=None, verbose=True):
+    """Play engine1 against engine2; returns a summary dict from engine1's view"""
+    seed = random.randrange(1 << 30) if seed is None else seed
+    tasks = []
+    for index in range(games):
+        # Each pair of games shares an opening, with colors swapped
+        white, black = (engine1, engine2) if index % 2 == 0 else (engine2, engine1)
+        tasks.append((index, white, black, seed + index // 2, opening_plies, movetime))
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+
+    wins = draws = losses = 0
+    reasons = {}
+    started = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(use_book,)) as pool:
+        for done, record in enumerate(pool.imap_unordered(play_game, tasks), 1):
+            engine1_white = record['game'] % 2 == 0
+            if "wins" not in record['result']:
+                draws += 1
+            elif ("White wins" in record['result']) == engine1_white:
+                wins += 1
+            else:
+                losses += 1
+            reasons[record['reason']] = reasons.get(record['reason'], 0) + 1
+            if log_dir:
+                save_game_log(record, log_dir)
+            if verbose:
+                print(f"Game {record['game'] + 1}: {record['white']} vs {record['black']}: "
+                      f"{record['result']} ({record['plies']} plies) "
+                      f"[{done}/{games}, +{wins} ={draws} -{losses}]")
+
+    elapsed = time.perf_counter() - started
+    elo, elo_low, elo_high = elo_difference(wins, draws, losses)
+    return {
+        'engine1': engine1,
+        'engine2': engine2,
+        'games': games,
+        'wins': wins,
+        'draws': draws,
+        'losses': losses,
+        'elo': elo,
+        'elo_low': elo_low,
+        'elo_high': elo_high,
+        'reasons': reasons,
+        'seconds': elapsed,
+        'games_per_second': games / elapsed if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play AI engines against each other")
+    parser.add_argument("engine1")
+    parser.add_argument("engine2")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--movetime", type=float, default=0.1, help="seconds per move for searching engines")
+    parser.add_argument("--opening-plies", type=int, default=4, help="random plies before the engines take over")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--book", action="store_true", help="let hard mode use the opening book")
+    parser.add_argument("--log-dir", default=None, help="save games here in game_loop's log format")
+    args = parser.parse_args(argv)
+
+    summary = run_match(args.engine1, args.engine2, args.games, args.workers, args.movetime,
+                        args.opening_plies, args.seed, args.book, args.log_dir)
+    print(f"\n{summary['engine1']} vs {summary['engine2']}: "
+          f"+{summary['wins']} ={summary['draws']} -{summary['losses']}")
+    print(f"Elo difference: {format_elo(summary['elo'], summary['elo_low'], summary['elo_high'])}")
+    print(f"Results by reason: {summary['reasons']}")
+    print(f"{summary['games']} games in {summary['seconds']:.1f}s "
+          f"({summary['games_per_second']:.2f} games/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,432 @@
+"""Compiled opening book built from the game logs.
+
+A book file is a header followed by fixed-width records sorted by Zobrist
+key and move:
+
+    key (8 bytes) | move (2 bytes) | wins | losses | draws (4 bytes each)
+
+Wins, losses and draws are counted for the side that played the move. Book
+files are memory-mapped and searched by binary search, so opening one costs
+the same no matter how many games went into it.
+
+The learned state is kept in four files next to each other:
+
+    opening_book.bin       the main book
+    opening_book.delta     a small book of recent changes, added to the main
+                           book on lookup and folded into it once it grows
+    opening_book.ledger    what each log contributed, so a log that changes
+                           on disk can be taken back out
+    opening_book.manifest  one line per ingested log: size, mtime and where
+                           its ledger entries are
+
+Updating only reads logs that are new or changed since the last update, and
+only rewrites the small delta book, so it costs time in proportion to the
+new games rather than the whole history. A .cga game archive counts as one
+log, so adding games to an archive rereads the whole archive.
+
+    python opening_book.py                              # add new and changed logs
+    python opening_book.py chess_games/games.cga        # or an archive
+    python opening_book.py --rebuild                    # start over from every log
+"""
+import argparse
+import heapq
+import math
+import mmap
+import os
+import random
+import struct
+import sys
+
+from game_logs import list_game_logs, normalize_move, outcome_for, read_game_log, white_outcome
+from position import Position, move_to_uci, square_index
+
+BOOK_PATH = "chess_games/opening_book.bin"
+
+MAGIC = b'CBK1'
+HEADER = struct.Struct('<4sI')
+RECORD = struct.Struct('<QHiii')
+KEY = struct.Struct('<Q')
+# key, move, outcome for the side that moved (0 win, 1 loss, 2 draw)
+LEDGER_RECORD = struct.Struct('<QHB')
+OUTCOME_INDEX = {'win': 0, 'loss': 1, 'draw': 2}
+
+# A book move needs this many games behind it before it is played
+MIN_BOOK_GAMES = 3
+# ...and a Wilson lower bound on its score of at least this; below it the
+# book has no move worth trusting and the search decides instead
+MIN_BOOK_SCORE = 0.3
+# Normal quantile for the Wilson bound; 1.96 is a 95% confidence interval
+WILSON_Z = 1.96
+
+# Fold the delta into the main book once it holds this many records. Each
+# update rewrites the whole delta, so this caps what saving one game costs
+# however big the main book grows.
+DELTA_MAX_RECORDS = 20000
+
+
+def companion_path(book_path, suffix):
+    return os.path.splitext(book_path)[0] + suffix
+
+
+def encode_log_move(move):
+    """Pack a logged 'e2e4' move into the 16-bit book move"""
+    move = normalize_move(move)
+    start = square_index(8 - int(move[1]), ord(move[0]) - 97)
+    end = square_index(8 - int(move[3]), ord(move[2]) - 97)
+    if not (0 <= start < 64 and 0 <= end < 64):
+        raise ValueError(f"Invalid move notation: {move!r}")
+    return start | (end << 6)
+
+
+def wilson_lower_bound(score, total, z=WILSON_Z):
+    """Lower end of the Wilson score interval for a score fraction over total games"""
+    if not total:
+        return 0.0
+    z2 = z * z
+    centre = score + z2 / (2 * total)
+    margin = z * math.sqrt((score * (1 - score) + z2 / (4 * total)) / total)
+    return (centre - margin) / (1 + z2 / total)
+
+
+class BookMove:
+    """Results of one move from a book position, for the side that played it"""
+    __slots__ = ('move', 'wins', 'losses', 'draws')
+
+    def __init__(self, move, wins=0, losses=0, draws=0):
+        self.move = move  # packed as in position.py
+        self.wins = wins
+        self.losses = losses
+        self.draws = draws
+
+    def __repr__(self):
+        return f"BookMove({self.uci}, +{self.wins} -{self.losses} ={self.draws})"
+
+    @property
+    def uci(self):
+        return move_to_uci(self.move)
+
+    @property
+    def total(self):
+        return self.wins + self.losses + self.draws
+
+    @property
+    def score(self):
+        """Points per game, a draw counting half"""
+        total = self.total
+        return (self.wins + 0.5 * self.draws) / total if total else 0.0
+
+    def confidence(self, z=WILSON_Z):
+        """Score we can be confident the move reaches, penalising thin samples"""
+        return wilson_lower_bound(self.score, self.total, z)
+
+
+def choose_book_move(moves, min_games=MIN_BOOK_GAMES, z=WILSON_Z, min_score=MIN_BOOK_SCORE):
+    """The move with the best Wilson lower bound among those played often enough, or None.
+
+    Ranking by the lower bound rather than the raw score stops a move that
+    won its only game from beating one that scored well over many. Moves
+    whose bound is under min_score are never chosen.
+    """
+    best, best_bound = [], -1.0
+    for entry in moves:
+        if entry.total < min_games:
+            continue
+        bound = entry.confidence(z)
+        if bound < min_score:
+            continue
+        if bound > best_bound:
+            best, best_bound = [entry], bound
+        elif bound == best_bound:
+            best.append(entry)
+    return random.choice(best) if best else None
+
+
+class BookFile:
+    """One memory-mapped, sorted book file"""
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._map = None
+        if os.path.exists(path) and os.path.getsize(path) > HEADER.size:
+            self._file = open(path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.count = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                self.close()
+                raise ValueError(f"{path} is not an opening book")
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._map = None
+        self._file = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _key_at(self, index):
+        return KEY.unpack_from(self._map, HEADER.size + index * RECORD.size)[0]
+
+    def lookup(self, key):
+        """Return [(move, wins, losses, draws), ...] for a position key"""
+        if not self.count:
+            return []
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        entries = []
+        for index in range(lo, self.count):
+            record_key, move, wins, losses, draws = RECORD.unpack_from(
+                self._map, HEADER.size + index * RECORD.size)
+            if record_key != key:
+                break
+            entries.append((move, wins, losses, draws))
+        return entries
+
+    def records(self):
+        for index in range(self.count):
+            yield RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+
+    def load(self):
+        """All records as {(key, move): [wins, losses, draws]}"""
+        return {(key, move): [wins, losses, draws] for key, move, wins, losses, draws in self.records()}
+
+
+class OpeningBook:
+    """The main book and its delta, read together"""
+    def __init__(self, path=BOOK_PATH):
+        self.path = path
+        self.main = BookFile(path)
+        self.delta = BookFile(companion_path(path, '.delta'))
+
+    def close(self):
+        self.main.close()
+        self.delta.close()
+
+    def __len__(self):
+        return len(self.main) + len(self.delta)
+
+    def lookup(self, key):
+        """Return [BookMove, ...] for a position key"""
+        totals = {}
+        for move, wins, losses, draws in self.main.lookup(key) + self.delta.lookup(key):
+            entry = totals.get(move)
+            if entry is None:
+                totals[move] = BookMove(move, wins, losses, draws)
+            else:
+                entry.wins += wins
+                entry.losses += losses
+                entry.draws += draws
+        return [entry for move, entry in sorted(totals.items()) if entry.total]
+
+    def choose(self, key, min_games=MIN_BOOK_GAMES, z=WILSON_Z, min_score=MIN_BOOK_SCORE):
+        """The book move to play from a position key, or None to search instead"""
+        return choose_book_move(self.lookup(key), min_games, z, min_score)
+
+
+def write_book(path, stats):
+    """Write {(key, move): [wins, losses, draws]} as a sorted book file"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        records = [(record, counts) for record, counts in sorted(stats.items()) if any(counts)]
+        f.write(HEADER.pack(MAGIC, len(records)))
+        for (key, move), (wins, losses, draws) in records:
+            f.write(RECORD.pack(key, move, wins, losses, draws))
+    os.replace(temp_path, path)
+
+
+def merge_books(paths, out_path):
+    """Stream-merge sorted book files into one, summing matching records.
+
+    Memory use stays flat however large the inputs are, which is what lets
+    bulk ingestion spill partial tables to disk.
+    """
+    books = [BookFile(path) for path in paths]
+    temp_path = out_path + '.tmp'
+    count = 0
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0))
+        current = None
+        totals = [0, 0, 0]
+        for key, move, wins, losses, draws in heapq.merge(*(book.records() for book in books)):
+            if (key, move) != current:
+                if current is not None and any(totals):
+                    f.write(RECORD.pack(current[0], current[1], *totals))
+                    count += 1
+                current = (key, move)
+                totals = [0, 0, 0]
+            totals[0] += wins
+            totals[1] += losses
+            totals[2] += draws
+        if current is not None and any(totals):
+            f.write(RECORD.pack(current[0], current[1], *totals))
+            count += 1
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, count))
+    for book in books:
+        book.close()
+    os.replace(temp_path, out_path)
+    return count
+
+
+def game_records(filename):
+    """Ledger records for one log or archive, reporting and skipping malformed moves"""
+    if filename.endswith('.cga'):
+        return archive_records(filename)
+    result, moves = read_game_log(filename)
+    if not result or not moves:
+        return []
+    outcome = white_outcome(result)
+    records = []
+    for ply, (fen_before, move) in enumerate(moves, 1):
+        try:
+            key = Position.from_fen(fen_before).hash
+            side = fen_before.rsplit(' ', 1)[-1]
+            records.append((key, encode_log_move(move), OUTCOME_INDEX[outcome_for(side, outcome)]))
+        except (ValueError, KeyError, IndexError) as e:
+            print(f"{filename}: skipping move {ply} ({move!r}): {e}")
+    return records
+
+
+def archive_records(filename):
+    """Ledger records for every game in a .cga archive.
+
+    The archive's moves were checked when it was written, so only games
+    without a result are skipped. A truncated archive keeps the games
+    before the damage.
+    """
+    from game_archive import iter_archive
+
+    records = []
+    try:
+        for game in iter_archive(filename):
+            if not game.result or not len(game):
+                continue
+            outcome = white_outcome(game.result)
+            for position, move in game.positions():
+                # Book moves carry no promotion piece
+                side = 'w' if position.turn == 'white' else 'b'
+                records.append((position.hash, move & 0xFFF, OUTCOME_INDEX[outcome_for(side, outcome)]))
+    except ValueError as e:
+        print(f"{filename}: {e}; keeping the games before it")
+    return records
+
+
+def read_manifest(path):
+    """{filename: (size, mtime_ns, ledger_offset, record_count)}; later lines win"""
+    manifest = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 5:
+                    manifest[fields[0]] = tuple(int(value) for value in fields[1:])
+    return manifest
+
+
+def read_ledger(path, offset, count):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(count * LEDGER_RECORD.size)
+    return list(LEDGER_RECORD.iter_unpack(data))
+
+
+def pending_logs(log_files, manifest):
+    """Logs that are new or changed, as (filename, stat result, old manifest entry)"""
+    pending = []
+    for filename in log_files:
+        try:
+            info = os.stat(filename)
+        except OSError as e:
+            print(f"Skipping {filename}: {e}")
+            continue
+        known = manifest.get(filename)
+        if known is None or known[:2] != (info.st_size, info.st_mtime_ns):
+            pending.append((filename, info, known))
+    return pending
+
+
+def manifest_line(filename, size, mtime_ns, ledger_offset, record_count):
+    return f"{filename}\t{size}\t{mtime_ns}\t{ledger_offset}\t{record_count}\n"
+
+
+def remove_book_files(book_path):
+    for path in (book_path, companion_path(book_path, '.delta'),
+                 companion_path(book_path, '.ledger'), companion_path(book_path, '.manifest')):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def apply_records(stats, records, sign=1):
+    for key, move, outcome in records:
+        entry = stats.setdefault((key, move), [0, 0, 0])
+        entry[outcome] += sign
+
+
+def update_book(book_path=BOOK_PATH, log_files=None, rebuild=False):
+    """Fold new and changed logs into the book; returns how many were read"""
+    if log_files is None:
+        log_files = list_game_logs()
+    delta_path = companion_path(book_path, '.delta')
+    ledger_path = companion_path(book_path, '.ledger')
+    manifest_path = companion_path(book_path, '.manifest')
+    if rebuild:
+        remove_book_files(book_path)
+
+    pending = pending_logs(log_files, read_manifest(manifest_path))
+    if not pending:
+        return 0
+
+    delta_file = BookFile(delta_path)
+    delta = delta_file.load()
+    delta_file.close()
+
+    ledger_offset = os.path.getsize(ledger_path) if os.path.exists(ledger_path) else 0
+    with open(ledger_path, 'ab') as ledger, open(manifest_path, 'a') as manifest_out:
+        for filename, info, known in pending:
+            try:
+                records = game_records(filename)
+            except OSError as e:
+                print(f"Skipping {filename}: {e}")
+                continue
+            if known is not None:
+                # The log changed since it was counted: take the old counts out
+                apply_records(delta, read_ledger(ledger_path, known[2], known[3]), -1)
+            apply_records(delta, records)
+            for record in records:
+                ledger.write(LEDGER_RECORD.pack(*record))
+            manifest_out.write(manifest_line(filename, info.st_size, info.st_mtime_ns,
+                                             ledger_offset, len(records)))
+            ledger_offset += len(records) * LEDGER_RECORD.size
+
+    write_book(delta_path, delta)
+    if len(delta) >= DELTA_MAX_RECORDS:
+        # A streaming merge, so folding never holds the main book in memory
+        merge_books([book_path, delta_path], book_path)
+        os.remove(delta_path)
+    return len(pending)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the opening book from game logs")
+    parser.add_argument("sources", nargs='*', help="game logs or .cga archives (default: chess_games/*.txt)")
+    parser.add_argument("--book", default=BOOK_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="start over from every log")
+    args = parser.parse_args(argv)
+
+    updated = update_book(args.book, args.sources or None, rebuild=args.rebuild)
+    book = OpeningBook(args.book)
+    print(f"Read {updated} new or changed log(s); {len(book)} book entries in {args.book}")
+    book.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
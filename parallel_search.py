@@ -0,0 +1,163 @@
+"""Lazy SMP: the hard AI's search spread over several worker processes.
+
+Every worker runs the ordinary iterative-deepening search on the same
+position, sharing one transposition table in shared memory. What one worker
+learns is picked up by the others from the table, so together they reach a
+given depth sooner. Odd-numbered helpers start one ply deeper than the rest
+so the workers do not all search the same tree in lockstep. The answer comes
+from whichever worker completed the deepest iteration, the main worker
+winning ties.
+
+    python parallel_search.py --workers 1 2 4 --movetime 2
+    python parallel_search.py --workers 1 4 --depth 5 --fen "<fen>"
+
+The benchmark reports, for each worker count, the depth reached in the time
+limit (or the time taken to a fixed depth), total and per-worker nodes per
+second, and the speedup over a single worker.
+"""
+import argparse
+import atexit
+import multiprocessing
+import sys
+import time
+
+from position import START_FEN, Position
+from search import Search, SearchTimeout
+from tablebase import Tablebase
+from transposition import SharedTranspositionTable
+
+# Set up once per worker process by _init_worker
+_worker_search = None
+_stop_event = None
+
+
+class WorkerSearch(Search):
+    """Search that also stops as soon as another worker sets the stop event"""
+    def check_time(self):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and (self.stopped or _stop_event.is_set() or time.time() > self.deadline):
+            raise SearchTimeout()
+
+
+def _init_worker(size_mb, buffer, stop_event):
+    global _worker_search, _stop_event
+    _stop_event = stop_event
+    _worker_search = WorkerSearch(tt=SharedTranspositionTable(size_mb, buffer), tablebase=Tablebase())
+
+
+def search_worker(task):
+    """Worker: one Lazy SMP thread of the search; returns its result and node count"""
+    index, fen, time_limit, max_depth, generation, queen_promotions_only = task
+    search = _worker_search
+    search.time_limit = time_limit
+    search.max_depth = max_depth
+    search.queen_promotions_only = queen_promotions_only
+    search.tt.generation = generation
+    started = time.time()
+    move, score, depth = search.search(Position.from_fen(fen), first_depth=1 + index % 2)
+    return index, move, score, depth, search.nodes, time.time() - started
+
+
+class ParallelSearch:
+    """Drop-in for Search that runs on a pool of worker processes"""
+    def __init__(self, workers=2, time_limit=1.0, max_depth=64, hash_mb=16):
+        self.workers = workers
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.queen_promotions_only = False  # As on Search
+        self.tt = SharedTranspositionTable(hash_mb)
+        self.stop_event = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                         initargs=(hash_mb, self.tt.buffer, self.stop_event))
+        self.nodes = 0
+        self.last_stats = None
+        atexit.register(self.close)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def search(self, position):
+        """Best move as (move, score, depth); per-worker figures go to last_stats"""
+        self.tt.new_search()
+        self.stop_event.clear()
+        fen = position.to_fen(full=True)
+        tasks = [(index, fen, self.time_limit, self.max_depth, self.tt.generation, self.queen_promotions_only)
+                 for index in range(self.workers)]
+        started = time.time()
+        results = []
+        for result in self.pool.imap_unordered(search_worker, tasks):
+            results.append(result)
+            if result[0] == 0:
+                # Once the main worker is done the helpers have nothing to add
+                self.stop_event.set()
+        elapsed = time.time() - started
+
+        results.sort()
+        best = max(results, key=lambda result: (result[3], -result[0]))
+        self.nodes = sum(result[4] for result in results)
+        self.last_stats = {
+            'workers': self.workers,
+            'depth': best[3],
+            'seconds': elapsed,
+            'nodes': self.nodes,
+            'nps': self.nodes / elapsed if elapsed else 0.0,
+            'worker_nps': [result[4] / result[5] if result[5] else 0.0 for result in results],
+            'worker_depths': [result[3] for result in results],
+        }
+        return best[1], best[2], best[3]
+
+
+def benchmark(fens, worker_counts, movetime, depth=None, hash_mb=16):
+    """Search each position with each worker count; returns {workers: totals}"""
+    totals = {}
+    for workers in worker_counts:
+        search = ParallelSearch(workers, None if depth else movetime, depth or 64, hash_mb)
+        total = {'seconds': 0.0, 'nodes': 0, 'depth': 0, 'worker_nps': [0.0] * workers}
+        for fen in fens:
+            search.tt.clear()
+            search.search(Position.from_fen(fen))
+            stats = search.last_stats
+            total['seconds'] += stats['seconds']
+            total['nodes'] += stats['nodes']
+            total['depth'] += stats['depth']
+            for index, nps in enumerate(stats['worker_nps']):
+                total['worker_nps'][index] += nps / len(fens)
+        search.close()
+        totals[workers] = total
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the parallel search against worker counts")
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument("--movetime", type=float, default=2.0, help="seconds per position")
+    parser.add_argument("--depth", type=int, default=None, help="time a fixed depth instead of a time limit")
+    parser.add_argument("--fen", action="append", help="position to search (repeatable; default: start)")
+    parser.add_argument("--hash", type=int, default=16, help="shared transposition table size in MB")
+    args = parser.parse_args(argv)
+
+    fens = args.fen or [START_FEN]
+    totals = benchmark(fens, args.workers, args.movetime, args.depth, args.hash)
+    baseline = totals[args.workers[0]]
+    for workers, total in totals.items():
+        nps = total['nodes'] / total['seconds'] if total['seconds'] else 0.0
+        if args.depth:
+            # Time to reach the same depth
+            ratio = baseline['seconds'] / total['seconds'] if total['seconds'] else 0.0
+            speedup = f"time-to-depth speedup {ratio:.2f}x"
+        else:
+            # Nodes searched in the same time
+            ratio = total['nodes'] / baseline['nodes'] if baseline['nodes'] else 0.0
+            speedup = f"{ratio:.2f}x the nodes"
+        per_worker = ' '.join(f"{rate:.0f}" for rate in total['worker_nps'])
+        print(f"{workers} worker(s): avg depth {total['depth'] / len(fens):.1f}, "
+              f"{total['seconds']:.2f}s, {total['nodes']} nodes, {nps:.0f} nps, "
+              f"{speedup}, nps per worker [{per_worker}]")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
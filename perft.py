@@ -0,0 +1,115 @@
+"""Perft: count the leaf nodes of the legal move tree from a position.
+
+Used to check the move generator against known node counts and to time it.
+
+    python perft.py 4                         # start position, depth 4
+    python perft.py 3 --fen "<fen>" --divide  # node count per root move
+    python perft.py --suite                   # standard positions with known counts
+"""
+import argparse
+import sys
+import time
+
+from position import Position, START_FEN, generate_legal_moves, move_to_uci
+
+# (name, FEN, {depth: expected leaf nodes})
+PERFT_SUITE = [
+    ("start position", START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("talkchess", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+]
+
+
+def perft(position, depth):
+    if depth == 0:
+        return 1
+    moves = generate_legal_moves(position)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        undo = position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move(undo)
+    return nodes
+
+
+def divide(position, depth):
+    """Leaf node count below each root move, as (uci, nodes) pairs"""
+    results = []
+    for move in generate_legal_moves(position):
+        undo = position.make_move(move)
+        results.append((move_to_uci(move), perft(position, depth - 1)))
+        position.unmake_move(undo)
+    return sorted(results)
+
+
+def timed_perft(position, depth):
+    start = time.perf_counter()
+    nodes = perft(position, depth)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed
+
+
+def run_suite(max_nodes=200000):
+    """Run every suite entry whose expected count is at most max_nodes"""
+    failures = 0
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, counts in PERFT_SUITE:
+        for depth, expected in sorted(counts.items()):
+            if expected > max_nodes:
+                continue
+            nodes, elapsed = timed_perft(Position.from_fen(fen), depth)
+            total_nodes += nodes
+            total_time += elapsed
+            status = "ok" if nodes == expected else f"FAIL (expected {expected})"
+            print(f"{name:<16} depth {depth}: {nodes:>10} nodes  "
+                  f"{nodes / max(elapsed, 1e-9):>10.0f} nps  {status}")
+            if nodes != expected:
+                failures += 1
+    print(f"\nTotal: {total_nodes} nodes in {total_time:.2f}s "
+          f"({total_nodes / max(total_time, 1e-9):.0f} nps), {failures} failure(s)")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count move generator leaf nodes")
+    parser.add_argument("depth", type=int, nargs="?", default=3)
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--divide", action="store_true", help="show the count per root move")
+    parser.add_argument("--suite", action="store_true", help="run the built-in positions")
+    parser.add_argument("--max-nodes", type=int, default=200000,
+                        help="skip suite entries larger than this")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 1 if run_suite(args.max_nodes) else 0
+
+    position = Position.from_fen(args.fen)
+    start = time.perf_counter()
+    if args.divide:
+        results = divide(position, args.depth)
+        for uci, nodes in results:
+            print(f"{uci}: {nodes}")
+        nodes = sum(count for _, count in results)
+        print(f"\nMoves: {len(results)}")
+    else:
+        nodes = perft(position, args.depth)
+    elapsed = time.perf_counter() - start
+    print(f"Nodes: {nodes}")
+    print(f"Time: {elapsed:.3f}s ({nodes / max(elapsed, 1e-9):.0f} nps)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Thinking on the opponent's time.
+
+After the AI moves, the search's own principal variation says what reply it
+expects. A Ponderer plays that reply on a copy of the position and searches
+the result on a background thread while the human is still deciding. If the
+human plays the expected move (a ponder hit), the search already under way
+carries on until the move's time budget, counted from when pondering began,
+runs out, so a human who took longer than the budget gets an instant reply.
+On a miss the background search is stopped and its work is not wasted: the
+transposition table it filled is the one the real search then reads.
+
+Only the single-process Search can ponder; it is stopped through its
+stopped flag and its deadline, which are safe to set from another thread.
+"""
+import threading
+import time
+
+from position import WHITE, ZOBRIST_EP_FILE, Position, generate_legal_moves, play_log_move
+
+
+class Ponderer:
+    def __init__(self, search):
+        self.search = search
+        self.thread = None
+        self.key = None  # Hash of the position being pondered, as Position.board_hash gives it
+        self.started = None
+        self.result = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        """Share of finished ponders whose position came up on the board"""
+        finished = self.hits + self.misses
+        return self.hits / finished if finished else 0.0
+
+    def expected_reply(self, position):
+        """The reply the last search expects from position, or None"""
+        entry = self.search.tt.probe(position.hash)
+        if entry is None:
+            # After a double pawn push the search saw an en passant square the
+            # console board doesn't keep, so look for the position with one
+            mover_pawn, rank = ('p', 3) if position.turn == WHITE else ('P', 4)
+            for col in range(8):
+                if position.squares[rank * 8 + col] == mover_pawn:
+                    entry = self.search.tt.probe(position.hash ^ ZOBRIST_EP_FILE[col])
+                    if entry is not None:
+                        break
+        if entry is None or not entry[3]:
+            return None
+        return entry[3] if entry[3] in generate_legal_moves(position) else None
+
+    def start(self, board, color):
+        """Ponder the position after color's expected reply; returns the expected move or None"""
+        self.stop()
+        position = Position.from_board(board, color)
+        move = self.expected_reply(position)
+        if move is None:
+            return None
+        # The console game has no en passant, so the pondered position is
+        # dropped to the same footing as one built from its board
+        play_log_move(position, move)
+        if not generate_legal_moves(position):
+            return None
+        self.key = position.hash
+        self.result = None
+        self.search.stopped = False
+        self.search.time_limit = None
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run, args=(position,), daemon=True)
+        self.thread.start()
+        return move
+
+    def _run(self, position):
+        self.result = self.search.search(position)
+
+    def finish(self, board, color, time_limit):
+        """(move, score, depth) if the pondered position is on the board, else None.
+
+        On a hit the search gets whatever is left of time_limit since
+        pondering started, so the answer is immediate once that has passed.
+        Pondering is stopped either way.
+        """
+        if self.thread is None:
+            return None
+        if Position.board_hash(board, color) != self.key:
+            self.misses += 1
+            self.stop()
+            return None
+        self.hits += 1
+        # search() works out its deadline from time_limit when it starts, so
+        # set both, and keep setting the deadline in case the thread was just
+        # starting and wrote over it
+        self.search.time_limit = time_limit
+        deadline = self.started + time_limit
+        while self.thread.is_alive():
+            self.search.deadline = deadline
+            self.thread.join(0.05)
+        result = self.result
+        self._reset()
+        if result is None or not result[2]:
+            return None  # Not even one iteration finished; search afresh
+        return result
+
+    def stop(self):
+        """Abandon any pondering; the search is ready for normal use afterwards"""
+        if self.thread is None:
+            return
+        self.search.stop()
+        self.thread.join()
+        self._reset()
+
+    def _reset(self):
+        self.thread = None
+        self.key = None
+        self.result = None
+        self.search.stopped = False
@@ -0,0 +1,692 @@
+"""Bitboard position representation used by the engine.
+
+Squares are numbered the same way the console board lists are indexed:
+square = row * 8 + col, so a8 is square 0 and h1 is square 63. Every piece
+type of each color gets its own 64-bit integer bitboard, and a flat list of
+64 one-char strings mirrors them for quick "what is on this square" lookups.
+"""
+
+import random
+
+from piece_square import ENDGAME_SCORES, MIDDLEGAME_SCORES, PIECE_PHASE
+
+WHITE = 'white'
+BLACK = 'black'
+OPPONENT = {WHITE: BLACK, BLACK: WHITE}
+
+EMPTY = '.'
+PIECES = 'PNBRQKpnbrqk'
+PIECE_COLOR = {p: (WHITE if p.isupper() else BLACK) for p in PIECES}
+
+FULL_BOARD = (1 << 64) - 1
+
+# Zobrist keys, drawn from a fixed seed so hashes are stable between runs
+_zobrist_random = random.Random(20250203)
+ZOBRIST_PIECES = {piece: [_zobrist_random.getrandbits(64) for _ in range(64)] for piece in PIECES}
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for _ in range(16)]
+ZOBRIST_EP_FILE = [_zobrist_random.getrandbits(64) for _ in range(8)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+
+
+def square_index(row, col):
+    return row * 8 + col
+
+
+def square_name(square):
+    row, col = divmod(square, 8)
+    return f"{chr(col + 97)}{8 - row}"
+
+
+def lsb(bb):
+    # Index of the lowest set bit
+    return (bb & -bb).bit_length() - 1
+
+
+def msb(bb):
+    # Index of the highest set bit
+    return bb.bit_length() - 1
+
+
+def iter_bits(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def popcount(bb):
+    return bin(bb).count('1')
+
+
+# Precomputed attack tables
+def _step_table(deltas):
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        bb = 0
+        for dr, dc in deltas:
+            r, c = row + dr, col + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                bb |= 1 << (r * 8 + c)
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _step_table([(-2, -1), (-2, 1), (2, -1), (2, 1),
+                              (-1, -2), (1, -2), (-1, 2), (1, 2)])
+KING_ATTACKS = _step_table([(-1, 0), (1, 0), (0, -1), (0, 1),
+                            (-1, -1), (-1, 1), (1, -1), (1, 1)])
+# Squares a pawn of the given color attacks from each square
+PAWN_ATTACKS = {
+    WHITE: _step_table([(-1, -1), (-1, 1)]),
+    BLACK: _step_table([(1, -1), (1, 1)]),
+}
+
+# Sliding directions as (row delta, col delta). Directions that walk towards
+# higher square indexes find their first blocker with lsb, the others with msb.
+NORTH, SOUTH, WEST, EAST = (-1, 0), (1, 0), (0, -1), (0, 1)
+NORTH_WEST, NORTH_EAST, SOUTH_WEST, SOUTH_EAST = (-1, -1), (-1, 1), (1, -1), (1, 1)
+ROOK_DIRECTIONS = (NORTH, SOUTH, WEST, EAST)
+BISHOP_DIRECTIONS = (NORTH_WEST, NORTH_EAST, SOUTH_WEST, SOUTH_EAST)
+POSITIVE_DIRECTIONS = (SOUTH, EAST, SOUTH_WEST, SOUTH_EAST)
+
+
+def _ray_table(direction):
+    dr, dc = direction
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        bb = 0
+        r, c = row + dr, col + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            bb |= 1 << (r * 8 + c)
+            r, c = r + dr, c + dc
+        table.append(bb)
+    return table
+
+
+RAYS = {direction: _ray_table(direction) for direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+
+
+def _slider_attacks(square, occupied, directions):
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][square]
+        blockers = ray & occupied
+        if blockers:
+            if direction in POSITIVE_DIRECTIONS:
+                blocker = lsb(blockers)
+            else:
+                blocker = msb(blockers)
+            ray ^= RAYS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(square, occupied):
+    return _slider_attacks(square, occupied, ROOK_DIRECTIONS)
+
+
+def bishop_attacks(square, occupied):
+    return _slider_attacks(square, occupied, BISHOP_DIRECTIONS)
+
+
+def queen_attacks(square, occupied):
+    return _slider_attacks(square, occupied, ROOK_DIRECTIONS + BISHOP_DIRECTIONS)
+
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Castling rights bits
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+CASTLING_LETTERS = ((WHITE_KINGSIDE, 'K'), (WHITE_QUEENSIDE, 'Q'),
+                    (BLACK_KINGSIDE, 'k'), (BLACK_QUEENSIDE, 'q'))
+
+# Rights that survive a move touching each square (king and rook home squares)
+CASTLING_MASK = [15] * 64
+CASTLING_MASK[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[0] = 15 & ~BLACK_QUEENSIDE
+CASTLING_MASK[7] = 15 & ~BLACK_KINGSIDE
+CASTLING_MASK[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[56] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASK[63] = 15 & ~WHITE_KINGSIDE
+
+# King destination -> (rook from, rook to) for each castling move
+CASTLING_ROOKS = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+
+
+class Position:
+    def __init__(self):
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.occupancy = {WHITE: 0, BLACK: 0}
+        self.squares = [EMPTY] * 64
+        self.turn = WHITE
+        self.castling = 0
+        self.ep_square = None
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.hash = 0
+        # Running material and piece-square totals (White minus Black) and
+        # game phase, kept up to date by put_piece and remove_piece
+        self.middlegame = 0
+        self.endgame = 0
+        self.phase = 0
+
+    def copy(self):
+        other = Position.__new__(Position)
+        other.bitboards = dict(self.bitboards)
+        other.occupancy = dict(self.occupancy)
+        other.squares = list(self.squares)
+        other.turn = self.turn
+        other.castling = self.castling
+        other.ep_square = self.ep_square
+        other.halfmove_clock = self.halfmove_clock
+        other.fullmove_number = self.fullmove_number
+        other.hash = self.hash
+        other.middlegame = self.middlegame
+        other.endgame = self.endgame
+        other.phase = self.phase
+        return other
+
+    @property
+    def occupied(self):
+        return self.occupancy[WHITE] | self.occupancy[BLACK]
+
+    def put_piece(self, square, piece):
+        bit = 1 << square
+        self.bitboards[piece] |= bit
+        self.occupancy[PIECE_COLOR[piece]] |= bit
+        self.squares[square] = piece
+        self.hash ^= ZOBRIST_PIECES[piece][square]
+        self.middlegame += MIDDLEGAME_SCORES[piece][square]
+        self.endgame += ENDGAME_SCORES[piece][square]
+        self.phase += PIECE_PHASE[piece]
+
+    def remove_piece(self, square):
+        piece = self.squares[square]
+        if piece != EMPTY:
+            bit = 1 << square
+            self.bitboards[piece] ^= bit
+            self.occupancy[PIECE_COLOR[piece]] ^= bit
+            self.squares[square] = EMPTY
+            self.hash ^= ZOBRIST_PIECES[piece][square]
+            self.middlegame -= MIDDLEGAME_SCORES[piece][square]
+            self.endgame -= ENDGAME_SCORES[piece][square]
+            self.phase -= PIECE_PHASE[piece]
+        return piece
+
+    def king_square(self, color):
+        king = self.bitboards['K' if color == WHITE else 'k']
+        return lsb(king) if king else None
+
+    def in_check(self, color=None):
+        if color is None:
+            color = self.turn
+        king_sq = self.king_square(color)
+        return king_sq is not None and bool(attackers_to(self, king_sq, OPPONENT[color]))
+
+    # Conversions to and from the console representations
+    @classmethod
+    def from_board(cls, board, turn=WHITE):
+        position = cls()
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece != EMPTY:
+                    position.put_piece(row * 8 + col, piece)
+        position.turn = turn
+        position.hash = position.compute_hash()
+        return position
+
+    @staticmethod
+    def board_hash(board, turn=WHITE):
+        """The hash from_board(board, turn) would get, without building the position"""
+        key = ZOBRIST_CASTLING[0]
+        square = 0
+        for row in board:
+            for piece in row:
+                if piece != EMPTY:
+                    key ^= ZOBRIST_PIECES[piece][square]
+                square += 1
+        if turn == BLACK:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key
+
+    def to_board(self):
+        return [self.squares[row * 8:row * 8 + 8] for row in range(8)]
+
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        position = cls()
+        for row, rank in enumerate(fields[0].split('/')):
+            col = 0
+            for c in rank:
+                if c.isdigit():
+                    col += int(c)
+                else:
+                    position.put_piece(row * 8 + col, c)
+                    col += 1
+        if len(fields) > 1:
+            position.turn = WHITE if fields[1] == 'w' else BLACK
+        if len(fields) > 2:
+            for right, letter in CASTLING_LETTERS:
+                if letter in fields[2]:
+                    position.castling |= right
+        if len(fields) > 3 and fields[3] != '-':
+            position.ep_square = (8 - int(fields[3][1])) * 8 + ord(fields[3][0]) - 97
+        if len(fields) > 5:
+            position.halfmove_clock = int(fields[4])
+            position.fullmove_number = int(fields[5])
+        position.hash = position.compute_hash()
+        return position
+
+    def compute_hash(self):
+        """Zobrist key from scratch; make_move keeps self.hash in step with it"""
+        key = 0
+        for square, piece in enumerate(self.squares):
+            if piece != EMPTY:
+                key ^= ZOBRIST_PIECES[piece][square]
+        key ^= ZOBRIST_CASTLING[self.castling]
+        if self.ep_square is not None:
+            key ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+        if self.turn == BLACK:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key
+
+    def compute_scores(self):
+        """(middlegame, endgame, phase) from scratch; put_piece keeps the totals in step"""
+        middlegame = endgame = phase = 0
+        for square, piece in enumerate(self.squares):
+            if piece != EMPTY:
+                middlegame += MIDDLEGAME_SCORES[piece][square]
+                endgame += ENDGAME_SCORES[piece][square]
+                phase += PIECE_PHASE[piece]
+        return middlegame, endgame, phase
+
+    def to_fen(self, full=False):
+        # Same layout board_to_fen writes to the game logs unless full is set
+        fen_rows = []
+        for row in range(8):
+            fen_row = []
+            empty = 0
+            for piece in self.squares[row * 8:row * 8 + 8]:
+                if piece == EMPTY:
+                    empty += 1
+                else:
+                    if empty > 0:
+                        fen_row.append(str(empty))
+                        empty = 0
+                    fen_row.append(piece)
+            if empty > 0:
+                fen_row.append(str(empty))
+            fen_rows.append(''.join(fen_row))
+        fen = '/'.join(fen_rows) + f' {self.turn[0]}'
+        if full:
+            castling = ''.join(letter for right, letter in CASTLING_LETTERS if self.castling & right)
+            ep = square_name(self.ep_square) if self.ep_square is not None else '-'
+            fen += f" {castling or '-'} {ep} {self.halfmove_clock} {self.fullmove_number}"
+        return fen
+
+    # Making and unmaking moves in place
+    def make_move(self, move):
+        """Play a packed move and return the undo record for unmake_move"""
+        start = move & 63
+        end = (move >> 6) & 63
+        promotion = move >> 12
+        piece = self.squares[start]
+        captured = self.squares[end]
+        captured_square = end
+        old_hash = self.hash
+
+        if captured != EMPTY:
+            self.remove_piece(end)
+        elif end == self.ep_square and piece in 'Pp':
+            captured_square = end + 8 if piece == 'P' else end - 8
+            captured = self.remove_piece(captured_square)
+        undo = (move, piece, captured, captured_square,
+                self.castling, self.ep_square, self.halfmove_clock, old_hash)
+
+        self.remove_piece(start)
+        if promotion:
+            promoted = PROMOTION_PIECES[promotion]
+            self.put_piece(end, promoted if piece == 'P' else promoted.lower())
+        else:
+            self.put_piece(end, piece)
+
+        if piece in 'Kk' and abs(end - start) == 2:
+            rook_from, rook_to = CASTLING_ROOKS[end]
+            self.put_piece(rook_to, self.remove_piece(rook_from))
+
+        key = self.hash ^ ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_BLACK_TO_MOVE
+        if self.ep_square is not None:
+            key ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+        self.castling &= CASTLING_MASK[start] & CASTLING_MASK[end]
+        key ^= ZOBRIST_CASTLING[self.castling]
+        if piece in 'Pp' and abs(end - start) == 16:
+            self.ep_square = (start + end) // 2
+            key ^= ZOBRIST_EP_FILE[end & 7]
+        else:
+            self.ep_square = None
+        self.hash = key
+        if piece in 'Pp' or captured != EMPTY:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if self.turn == BLACK:
+            self.fullmove_number += 1
+        self.turn = OPPONENT[self.turn]
+        return undo
+
+    def unmake_move(self, undo):
+        move, piece, captured, captured_square, castling, ep_square, halfmove_clock, key = undo
+        start = move & 63
+        end = (move >> 6) & 63
+        self.turn = OPPONENT[self.turn]
+        if self.turn == BLACK:
+            self.fullmove_number -= 1
+
+        if piece in 'Kk' and abs(end - start) == 2:
+            rook_from, rook_to = CASTLING_ROOKS[end]
+            self.put_piece(rook_from, self.remove_piece(rook_to))
+        self.remove_piece(end)
+        self.put_piece(start, piece)
+        if captured != EMPTY:
+            self.put_piece(captured_square, captured)
+
+        self.castling = castling
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        self.hash = key
+
+    def __str__(self):
+        return '\n'.join(' '.join(self.squares[row * 8:row * 8 + 8]) for row in range(8))
+
+
+# Moves are packed into 16-bit ints: from square (bits 0-5), to square
+# (bits 6-11) and promotion piece (bits 12-14), so a move list fits an
+# array('H'). Castling and en passant need no flag: make_move recognises them
+# from the piece that moves, and the same move always packs to the same int.
+PROMOTION_PIECES = '.NBRQ'
+NO_PROMOTION, KNIGHT_PROMOTION, BISHOP_PROMOTION, ROOK_PROMOTION, QUEEN_PROMOTION = range(5)
+
+
+def encode_move(start, end, promotion=NO_PROMOTION):
+    return start | (end << 6) | (promotion << 12)
+
+
+def move_from(move):
+    return move & 63
+
+
+def move_to(move):
+    return (move >> 6) & 63
+
+
+def move_promotion(move):
+    return move >> 12
+
+
+def move_to_coordinates(move):
+    return divmod(move & 63, 8), divmod((move >> 6) & 63, 8)
+
+
+def coordinates_to_move(start, end, promotion=NO_PROMOTION):
+    """Pack a ((row, col), (row, col)) move as used by the console board"""
+    return (start[0] * 8 + start[1]) | ((end[0] * 8 + end[1]) << 6) | (promotion << 12)
+
+
+def uci_to_move(text):
+    """Pack a UCI move string such as 'e2e4' or 'e7e8q'; the move isn't checked for legality"""
+    text = text.strip().lower()
+    if len(text) not in (4, 5) or text[0] not in 'abcdefgh' or text[2] not in 'abcdefgh' or \
+            text[1] not in '12345678' or text[3] not in '12345678':
+        raise ValueError(f"Invalid move: {text!r}")
+    move = square_index(8 - int(text[1]), ord(text[0]) - 97) | \
+        (square_index(8 - int(text[3]), ord(text[2]) - 97) << 6)
+    if len(text) == 5:
+        promotion = PROMOTION_PIECES.find(text[4].upper())
+        if promotion < KNIGHT_PROMOTION:
+            raise ValueError(f"Invalid promotion piece: {text!r}")
+        move |= promotion << 12
+    return move
+
+
+def move_to_uci(move):
+    uci = square_name(move & 63) + square_name((move >> 6) & 63)
+    if move >> 12:
+        uci += PROMOTION_PIECES[move >> 12].lower()
+    return uci
+
+
+def play_log_move(position, move):
+    """make_move without leaving an en passant square, as the console game and its logs have none"""
+    position.make_move(move)
+    if position.ep_square is not None:
+        position.hash ^= ZOBRIST_EP_FILE[position.ep_square & 7]
+        position.ep_square = None
+
+
+def _between_table():
+    table = [[0] * 64 for _ in range(64)]
+    for start in range(64):
+        row, col = divmod(start, 8)
+        for dr, dc in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            between = 0
+            r, c = row + dr, col + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                table[start][r * 8 + c] = between
+                between |= 1 << (r * 8 + c)
+                r, c = r + dr, c + dc
+    return table
+
+
+# Squares strictly between two squares on a shared line (0 if not aligned)
+BETWEEN = _between_table()
+
+
+def attackers_to(position, square, color, occupied=None):
+    """Bitboard of color's pieces attacking square"""
+    if occupied is None:
+        occupied = position.occupied
+    bb = position.bitboards
+    if color == WHITE:
+        pawns, knights, bishops, rooks, queens, king = bb['P'], bb['N'], bb['B'], bb['R'], bb['Q'], bb['K']
+    else:
+        pawns, knights, bishops, rooks, queens, king = bb['p'], bb['n'], bb['b'], bb['r'], bb['q'], bb['k']
+    attackers = (PAWN_ATTACKS[OPPONENT[color]][square] & pawns) | \
+                (KNIGHT_ATTACKS[square] & knights) | \
+                (KING_ATTACKS[square] & king)
+    if bishops | queens:
+        attackers |= bishop_attacks(square, occupied) & (bishops | queens)
+    if rooks | queens:
+        attackers |= rook_attacks(square, occupied) & (rooks | queens)
+    return attackers
+
+
+def pinned_pieces(position, color, king_sq):
+    """Map each pinned square of color to the squares it may still move to"""
+    pins = {}
+    occupied = position.occupied
+    own = position.occupancy[color]
+    bb = position.bitboards
+    if color == WHITE:
+        straight, diagonal = bb['r'] | bb['q'], bb['b'] | bb['q']
+    else:
+        straight, diagonal = bb['R'] | bb['Q'], bb['B'] | bb['Q']
+    for directions, sliders in ((ROOK_DIRECTIONS, straight), (BISHOP_DIRECTIONS, diagonal)):
+        if not sliders:
+            continue
+        for direction in directions:
+            ray = RAYS[direction][king_sq]
+            if not ray & sliders:
+                continue
+            blockers = ray & occupied
+            first_of = lsb if direction in POSITIVE_DIRECTIONS else msb
+            first = first_of(blockers)
+            if not (own >> first) & 1:
+                continue
+            rest = blockers ^ (1 << first)
+            if not rest:
+                continue
+            second = first_of(rest)
+            if (sliders >> second) & 1:
+                pins[first] = ray & ~RAYS[direction][second]
+    return pins
+
+
+def _add_pawn_moves(moves, start, targets, last_rank):
+    for end in iter_bits(targets):
+        if (1 << end) & last_rank:
+            for promotion in (QUEEN_PROMOTION, ROOK_PROMOTION, BISHOP_PROMOTION, KNIGHT_PROMOTION):
+                moves.append(start | (end << 6) | (promotion << 12))
+        else:
+            moves.append(start | (end << 6))
+
+
+RANK_8 = 0xFF
+RANK_1 = 0xFF << 56
+
+
+def tactical_targets(position, color=None):
+    """Destination squares of every capture and promotion for color.
+
+    Passed as targets to generate_legal_moves this yields all the tactical
+    moves, plus the odd quiet move that happens to land on one of these
+    squares.
+    """
+    if color is None:
+        color = position.turn
+    targets = position.occupancy[OPPONENT[color]] | (RANK_8 if color == WHITE else RANK_1)
+    if position.ep_square is not None:
+        targets |= 1 << position.ep_square
+    return targets
+
+
+def generate_legal_moves(position, color=None, targets=FULL_BOARD):
+    """Every strictly legal move for color in one pass.
+
+    Check evasions and pins are worked out up front, so no move has to be
+    tried on the board to see whether it leaves the king in check. targets
+    limits the destination squares, so captures and quiet moves can be
+    generated separately.
+    """
+    if color is None:
+        color = position.turn
+    them = OPPONENT[color]
+    squares = position.squares
+    own = position.occupancy[color]
+    enemies = position.occupancy[them]
+    occupied = own | enemies
+    empty = ~occupied & FULL_BOARD
+    moves = []
+
+    king_sq = position.king_square(color)
+    if king_sq is None:
+        checkers = 0
+        pins = {}
+        allowed = FULL_BOARD
+    else:
+        checkers = attackers_to(position, king_sq, them, occupied)
+        # King steps, judged with the king lifted off the board so it cannot
+        # hide behind itself from a slider
+        without_king = occupied ^ (1 << king_sq)
+        for end in iter_bits(KING_ATTACKS[king_sq] & ~own & targets):
+            if not attackers_to(position, end, them, without_king):
+                moves.append(king_sq | (end << 6))
+        if checkers & (checkers - 1):
+            return moves  # Double check: only the king can move
+        if checkers:
+            checker = lsb(checkers)
+            allowed = checkers | BETWEEN[king_sq][checker]
+        else:
+            allowed = FULL_BOARD
+        pins = pinned_pieces(position, color, king_sq)
+    allowed &= targets
+
+    pawn = 'P' if color == WHITE else 'p'
+    last_rank = RANK_8 if color == WHITE else RANK_1
+    pawn_captures = PAWN_ATTACKS[color]
+    for start in iter_bits(own):
+        piece = squares[start]
+        if start == king_sq:
+            continue
+        mask = allowed & pins[start] if start in pins else allowed
+        if piece == pawn:
+            if color == WHITE:
+                reach = (1 << (start - 8)) & empty
+                if reach and start >= 48:
+                    reach |= (1 << (start - 16)) & empty
+            else:
+                reach = (1 << (start + 8)) & empty
+                if reach and start < 16:
+                    reach |= (1 << (start + 16)) & empty
+            reach = (reach | (pawn_captures[start] & enemies)) & mask
+            _add_pawn_moves(moves, start, reach, last_rank)
+            continue
+        kind = piece.upper()
+        if kind == 'N':
+            reach = KNIGHT_ATTACKS[start]
+        elif kind == 'B':
+            reach = bishop_attacks(start, occupied)
+        elif kind == 'R':
+            reach = rook_attacks(start, occupied)
+        else:
+            reach = queen_attacks(start, occupied)
+        for end in iter_bits(reach & ~own & mask):
+            moves.append(start | (end << 6))
+
+    if position.ep_square is not None and (targets >> position.ep_square) & 1:
+        _add_en_passant_moves(position, moves, color, king_sq)
+    if position.castling and not checkers and king_sq is not None:
+        _add_castling_moves(position, moves, color, king_sq, occupied, targets)
+    return moves
+
+
+def _add_en_passant_moves(position, moves, color, king_sq):
+    ep = position.ep_square
+    bb = position.bitboards
+    pawn = 'P' if color == WHITE else 'p'
+    captured_square = ep + 8 if color == WHITE else ep - 8
+    for start in iter_bits(PAWN_ATTACKS[OPPONENT[color]][ep] & bb[pawn]):
+        if king_sq is not None:
+            # Both pawns leave their squares at once, so pins along the rank
+            # and the captured pawn itself are checked on the resulting board
+            occupied = (position.occupied ^ (1 << start) ^ (1 << captured_square)) | (1 << ep)
+            if color == WHITE:
+                straight, diagonal = bb['r'] | bb['q'], bb['b'] | bb['q']
+                others = (KNIGHT_ATTACKS[king_sq] & bb['n']) | (PAWN_ATTACKS[WHITE][king_sq] & bb['p'])
+            else:
+                straight, diagonal = bb['R'] | bb['Q'], bb['B'] | bb['Q']
+                others = (KNIGHT_ATTACKS[king_sq] & bb['N']) | (PAWN_ATTACKS[BLACK][king_sq] & bb['P'])
+            others &= ~(1 << captured_square)
+            if others or rook_attacks(king_sq, occupied) & straight or \
+                    bishop_attacks(king_sq, occupied) & diagonal:
+                continue
+        moves.append(start | (ep << 6))
+
+
+# (right, squares that must be empty, squares the king crosses, king destination)
+CASTLING_PATHS = {
+    WHITE: ((WHITE_KINGSIDE, (61, 62), (61, 62), 62),
+            (WHITE_QUEENSIDE, (57, 58, 59), (59, 58), 58)),
+    BLACK: ((BLACK_KINGSIDE, (5, 6), (5, 6), 6),
+            (BLACK_QUEENSIDE, (1, 2, 3), (3, 2), 2)),
+}
+
+
+def _add_castling_moves(position, moves, color, king_sq, occupied, targets=FULL_BOARD):
+    if king_sq != (60 if color == WHITE else 4):
+        return
+    rook = 'R' if color == WHITE else 'r'
+    them = OPPONENT[color]
+    for right, empty_squares, king_path, end in CASTLING_PATHS[color]:
+        if not position.castling & right or not (targets >> end) & 1:
+            continue
+        if position.squares[CASTLING_ROOKS[end][0]] != rook:
+            continue
+        if any((occupied >> square) & 1 for square in empty_squares):
+            continue
+        if any(attackers_to(position, square, them, occupied) for square in king_path):
+            continue
+        moves.append(king_sq | (end << 6))
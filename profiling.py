@@ -0,0 +1,147 @@
+"""Opt-in instrumentation for finding where a game's time goes.
+
+Set CHESS_PROFILE before starting a game to switch it on:
+
+    CHESS_PROFILE=1 python console_chess_ai.py                # chess_games/profile_<time>.json
+    CHESS_PROFILE=trace.json python console_chess_ai.py       # this file instead
+
+When on, the hot functions are swapped for wrappers that count calls and
+add up their time (callees included), and each AI move records its think
+time, search nodes and depth and whether the opening book answered. The
+lot is written as JSON when the game ends. When off nothing is wrapped and
+note() is a single None check, so the game runs at full speed.
+
+Two traces can be compared to spot regressions:
+
+    python profiling.py old.json new.json
+"""
+import datetime
+import functools
+import json
+import os
+import sys
+import time
+
+_profiler = None
+
+
+class Profiler:
+    def __init__(self, path):
+        self.path = path
+        self.started = time.time()
+        self.calls = {}  # name -> [calls, seconds]
+        self.moves = []
+        self._move = None
+
+    def instrument(self, module, names):
+        """Replace module-level functions with timing wrappers"""
+        for name in names:
+            setattr(module, name, self._wrap(name, getattr(module, name)))
+
+    def _wrap(self, name, func):
+        totals = self.calls.setdefault(name, [0, 0.0])
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                totals[0] += 1
+                totals[1] += time.perf_counter() - started
+        return wrapper
+
+    def begin_move(self, ply, color, player):
+        self._move = {'ply': ply, 'color': color, 'player': player, 'started': time.perf_counter()}
+
+    def note(self, **fields):
+        if self._move is not None:
+            self._move.update(fields)
+
+    def end_move(self):
+        move = self._move
+        if move is not None:
+            move['seconds'] = round(time.perf_counter() - move.pop('started'), 6)
+            if move.get('nodes') and move['seconds']:
+                move['nps'] = round(move['nodes'] / move['seconds'])
+            self.moves.append(move)
+        self._move = None
+
+    def report(self, game_stats=None):
+        functions = {
+            name: {
+                'calls': calls,
+                'seconds': round(seconds, 6),
+                'mean_us': round(seconds / calls * 1e6, 3) if calls else 0.0,
+            }
+            for name, (calls, seconds) in sorted(self.calls.items(), key=lambda item: -item[1][1])
+        }
+        return {
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'seconds': round(time.time() - self.started, 3),
+            'functions': functions,
+            'moves': self.moves,
+            'game': game_stats or {},
+        }
+
+    def dump(self, game_stats=None):
+        """Write the report as JSON; returns the path"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.report(game_stats), f, indent=1)
+        return self.path
+
+
+def enable_from_environment(module, names, default_dir="chess_games"):
+    """Start profiling if CHESS_PROFILE is set; returns the Profiler or None"""
+    global _profiler
+    setting = os.environ.get('CHESS_PROFILE')
+    if not setting or setting == '0':
+        return None
+    if setting.endswith('.json'):
+        path = setting
+    else:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(default_dir, f"profile_{timestamp}.json")
+    _profiler = Profiler(path)
+    _profiler.instrument(module, names)
+    return _profiler
+
+
+def note(**fields):
+    """Attach fields to the move being profiled, if profiling is on"""
+    if _profiler is not None:
+        _profiler.note(**fields)
+
+
+def compare(old, new, threshold=0.2):
+    """Lines describing functions whose mean time changed by more than threshold"""
+    lines = []
+    for name, after in new['functions'].items():
+        before = old['functions'].get(name)
+        if not before or not before['mean_us']:
+            continue
+        change = after['mean_us'] / before['mean_us'] - 1
+        flag = "SLOWER" if change > threshold else "faster" if change < -threshold else ""
+        lines.append(f"{name:24} {before['mean_us']:10.1f}us -> {after['mean_us']:10.1f}us "
+                     f"{change:+7.1%} {flag}")
+    return lines
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("Usage: python profiling.py OLD.json NEW.json")
+        return 2
+    with open(argv[0]) as f:
+        old = json.load(f)
+    with open(argv[1]) as f:
+        new = json.load(f)
+    print("\n".join(compare(old, new)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
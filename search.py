@@ -0,0 +1,321 @@
+"""Alpha-beta search used by the hard AI.
+
+Negamax with alpha-beta pruning, iterative deepening under a time budget
+and a quiescence search over captures so the static evaluation is only
+trusted in quiet positions.
+
+Alpha-beta prunes best when the best move comes first, so moves are tried
+in stages: the hash move, captures by MVV-LVA, the two killer moves for the
+ply (quiet moves that caused a cutoff in a sibling node), then the other
+quiet moves by their history score. Quiet moves are only generated once the
+earlier stages have failed to cut off.
+"""
+import time
+
+from evaluation import PIECE_VALUES, evaluate
+from position import EMPTY, FULL_BOARD, QUEEN_PROMOTION, generate_legal_moves, tactical_targets
+from transposition import EXACT, LOWER_BOUND, UPPER_BOUND, TranspositionTable
+
+PROMOTION_VALUES = [0, 320, 330, 500, 900]
+MATE_SCORE = 100000
+MATE_THRESHOLD = MATE_SCORE - 1000
+INFINITY = MATE_SCORE + 1
+# Deepest ply killer moves are kept for
+MAX_PLY = 128
+# History scores are halved once one passes this, so old cutoffs fade
+HISTORY_LIMIT = 1 << 20
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+# Mate scores are stored relative to the node so they stay correct when the
+# same position is reached at a different distance from the root
+def score_to_tt(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+def capture_score(position, move):
+    """MVV-LVA: most valuable victim first, cheapest attacker breaking ties"""
+    end = (move >> 6) & 63
+    victim = position.squares[end]
+    attacker = position.squares[move & 63]
+    if victim == EMPTY:
+        # En passant captures a pawn; plain promotions rank with captures
+        victim_value = 100 if attacker in 'Pp' and end == position.ep_square else 0
+    else:
+        victim_value = PIECE_VALUES[victim.upper()]
+    return victim_value * 10 - PIECE_VALUES[attacker.upper()] // 10 + PROMOTION_VALUES[move >> 12]
+
+
+def is_tactical(position, move):
+    end = (move >> 6) & 63
+    return position.squares[end] != EMPTY or move >> 12 or \
+        (end == position.ep_square and position.squares[move & 63] in 'Pp')
+
+
+class Search:
+    def __init__(self, time_limit=1.0, max_depth=64, tt=None, tablebase=None):
+        self.time_limit = time_limit  # None searches until max_depth or stop()
+        self.max_depth = max_depth
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.tablebase = tablebase
+        self.nodes = 0
+        self.deadline = None
+        self.node_limit = None  # Stop after about this many nodes, for fixed-effort analysis
+        # For front ends that always promote to a queen: leave underpromotions
+        # out at the root so the move searched is the move played
+        self.queen_promotions_only = False
+        self.stopped = False  # Set by stop(); cleared by whoever starts the next search
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        # Butterfly tables: cutoffs per side, indexed by the move's from and to squares
+        self.history = {'white': [0] * 4096, 'black': [0] * 4096}
+        # Called as on_iteration(depth, score, nodes, seconds, pv) after each
+        # completed depth
+        self.on_iteration = None
+
+    def stop(self):
+        """Make a running search return early; safe to call from another thread"""
+        self.stopped = True
+
+    def search(self, position, first_depth=1):
+        """Best move found within the time budget as (move, score, depth)"""
+        self.nodes = 0
+        started = time.time()
+        self.deadline = started + self.time_limit if self.time_limit is not None else float('inf')
+        self.tt.new_search()
+        self.new_search()
+        root_moves = generate_legal_moves(position)
+        if self.queen_promotions_only:
+            root_moves = [move for move in root_moves if move >> 12 in (0, QUEEN_PROMOTION)]
+        if not root_moves:
+            return None, 0, 0
+        root_moves.sort(key=lambda move: -capture_score(position, move) if is_tactical(position, move) else 0)
+        if self.tablebase is not None:
+            result = self.tablebase_move(position, root_moves)
+            if result is not None:
+                if self.on_iteration is not None:
+                    self.on_iteration(1, result[1], self.nodes, time.time() - started, [result[0]])
+                return result
+
+        best_move, best_score, completed_depth = root_moves[0], 0, 0
+        for depth in range(first_depth, self.max_depth + 1):
+            try:
+                move, score = self.search_root(position, root_moves, depth)
+            except SearchTimeout:
+                break
+            best_move, best_score, completed_depth = move, score, depth
+            if self.on_iteration is not None:
+                self.on_iteration(depth, score, self.nodes, time.time() - started,
+                                  self.principal_variation(position, move, depth))
+            # Search the previous best move first on the next iteration
+            root_moves.remove(move)
+            root_moves.insert(0, move)
+            if abs(score) >= MATE_THRESHOLD or len(root_moves) == 1:
+                break
+        return best_move, best_score, completed_depth
+
+    def tablebase_move(self, position, moves):
+        """(move, score, depth) straight from the tablebase, or None if it doesn't cover every move"""
+        best_move, best_score = None, -INFINITY
+        for move in moves:
+            undo = position.make_move(move)
+            score = self.tablebase.probe(position)
+            position.unmake_move(undo)
+            if score is None:
+                return None
+            score = score_from_tt(-score, 1)
+            if score > best_score:
+                best_move, best_score = move, score
+        return best_move, best_score, 1
+
+    def search_root(self, position, moves, depth):
+        alpha, beta = -INFINITY, INFINITY
+        best_move = moves[0]
+        for move in moves:
+            undo = position.make_move(move)
+            try:
+                score = -self.negamax(position, depth - 1, -beta, -alpha, 1)
+            finally:
+                position.unmake_move(undo)
+            if score > alpha:
+                alpha = score
+                best_move = move
+        self.tt.store(position.hash, depth, EXACT, score_to_tt(alpha, 0), best_move)
+        return best_move, alpha
+
+    def principal_variation(self, position, move, depth):
+        """move followed by the hash moves stored for the positions it leads to"""
+        pv = []
+        undos = []
+        seen = set()
+        while move and len(pv) < depth and position.hash not in seen:
+            if move not in generate_legal_moves(position):
+                break
+            seen.add(position.hash)
+            pv.append(move)
+            undos.append(position.make_move(move))
+            entry = self.tt.probe(position.hash)
+            move = entry[3] if entry is not None else 0
+        for undo in reversed(undos):
+            position.unmake_move(undo)
+        return pv
+
+    def check_time(self):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and (self.stopped or time.time() > self.deadline or
+                                       (self.node_limit is not None and self.nodes >= self.node_limit)):
+            raise SearchTimeout()
+
+    def negamax(self, position, depth, alpha, beta, ply):
+        self.check_time()
+        if self.tablebase is not None:
+            score = self.tablebase.probe(position)
+            if score is not None:
+                return score_from_tt(score, ply)
+        if depth <= 0:
+            return self.quiescence(position, alpha, beta, ply)
+        if position.halfmove_clock >= 100:
+            return 0
+
+        key = position.hash
+        original_alpha = alpha
+        hash_move = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_depth, bound, tt_score, hash_move = entry
+            if tt_depth >= depth:
+                tt_score = score_from_tt(tt_score, ply)
+                if bound == EXACT or (bound == LOWER_BOUND and tt_score >= beta) or \
+                        (bound == UPPER_BOUND and tt_score <= alpha):
+                    return tt_score
+
+        best_score = -INFINITY
+        best_move = 0
+        for move in self.pick_moves(position, hash_move, ply):
+            undo = position.make_move(move)
+            try:
+                score = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                position.unmake_move(undo)
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if score >= beta:
+                        if not is_tactical(position, move):
+                            self.record_cutoff(position.turn, move, depth, ply)
+                        break
+        if best_score == -INFINITY:
+            return -MATE_SCORE + ply if position.in_check() else 0
+
+        if best_score >= beta:
+            bound = LOWER_BOUND
+        elif best_score > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER_BOUND
+            best_move = 0  # No move proved best, keep any earlier hash move
+        self.tt.store(key, depth, bound, score_to_tt(best_score, ply), best_move)
+        return best_score
+
+    def quiescence(self, position, alpha, beta, ply):
+        self.check_time()
+        best_score = evaluate(position)
+        if best_score >= beta:
+            return best_score
+        if best_score > alpha:
+            alpha = best_score
+
+        captures = [move for move in generate_legal_moves(position, targets=tactical_targets(position))
+                    if is_tactical(position, move)]
+        captures.sort(key=lambda move: capture_score(position, move), reverse=True)
+        for move in captures:
+            undo = position.make_move(move)
+            try:
+                score = -self.quiescence(position, -beta, -alpha, ply + 1)
+            finally:
+                position.unmake_move(undo)
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if score >= beta:
+                        break
+        return best_score
+
+    def new_search(self):
+        """Forget the killers and age the history before searching a new position"""
+        for killers in self.killers:
+            killers[0] = killers[1] = 0
+        for table in self.history.values():
+            for index, value in enumerate(table):
+                if value:
+                    table[index] = value >> 1
+
+    def record_cutoff(self, color, move, depth, ply):
+        """Remember a quiet move that failed high as a killer and in the history"""
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        table = self.history[color]
+        table[move] += depth * depth
+        if table[move] > HISTORY_LIMIT:
+            for index, value in enumerate(table):
+                table[index] = value >> 1
+
+    def pick_moves(self, position, hash_move, ply):
+        """Yield the legal moves in search order, generating them stage by stage.
+
+        The position must be back as it was each time the next move is asked
+        for. A quiet hash move can only be checked against the quiet moves, so
+        those are generated up front in that case.
+        """
+        targets = tactical_targets(position)
+        captures = []
+        quiet = []  # Quiet moves that happen to land on a tactical square
+        for move in generate_legal_moves(position, targets=targets):
+            if is_tactical(position, move):
+                captures.append(move)
+            else:
+                quiet.append(move)
+        quiet_generated = False
+        if hash_move:
+            if hash_move not in captures:
+                quiet += generate_legal_moves(position, targets=FULL_BOARD & ~targets)
+                quiet_generated = True
+                if hash_move not in quiet:
+                    hash_move = 0
+            if hash_move:
+                yield hash_move
+
+        captures.sort(key=lambda move: capture_score(position, move), reverse=True)
+        for move in captures:
+            if move != hash_move:
+                yield move
+
+        if not quiet_generated:
+            quiet += generate_legal_moves(position, targets=FULL_BOARD & ~targets)
+        killers = [killer for killer in self.killers[ply] if killer and killer != hash_move and killer in quiet]
+        for move in killers:
+            yield move
+        history = self.history[position.turn]
+        quiet.sort(key=history.__getitem__, reverse=True)
+        for move in quiet:
+            if move != hash_move and move not in killers:
+                yield move
@@ -0,0 +1,387 @@
+"""Endgame tablebases: distance to mate for every position with few pieces.
+
+A table covers one material balance, such as KQvK or KRvKP, always stored
+with the first side as White. It has one byte per position:
+
+    0            draw
+    1 + plies    mate in that many plies, a win for the side to move when
+                 the count is odd and a loss when it is even
+    255          not a legal position
+
+Probes answer with search scores: 0 for a draw, MATE_SCORE - plies for a
+win and plies - MATE_SCORE for a loss.
+
+Positions are indexed by the white king, the black king and then the other
+pieces in table order, six bits a square, with the side to move last. The
+board is mirrored so the white king is always on files a-d, and for tables
+without pawns also on ranks 1-4, which cuts the size by two or four.
+
+Tables are built offline by retrograde analysis: checkmates are found
+first, then positions are resolved ply by ply by walking moves backwards
+from positions already resolved. Captures and promotions lead into smaller
+tables, which are built first. During a game, tables are memory-mapped and a
+probe is a single byte read.
+
+    python tablebase.py                  # the 3-piece tables: KQvK, KRvK, KPvK
+    python tablebase.py KQvKR KRvKP      # 4-piece tables (slow in pure Python)
+
+KvK and a lone minor piece are draws without needing a table.
+"""
+import argparse
+import itertools
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from position import BLACK, EMPTY, KING_ATTACKS, KNIGHT_ATTACKS, OPPONENT, WHITE, Position, \
+    bishop_attacks, generate_legal_moves, iter_bits, popcount, queen_attacks, rook_attacks
+
+TABLEBASE_DIR = "tablebases"
+DEFAULT_TABLES = ['KQvK', 'KRvK', 'KPvK']
+
+MAGIC = b'CTB1'
+HEADER = struct.Struct('<4s16s')
+DRAW, INVALID = 0, 255
+PIECE_ORDER = 'QRBNP'
+PIECE_WORTH = {'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+MAX_PIECES = 4
+
+# Same scale as search.MATE_SCORE
+MATE_SCORE = 100000
+
+
+def material_signature(white, black):
+    """'KQvKR' style name for the non-king pieces of each side"""
+    return 'K' + ''.join(sorted(white, key=PIECE_ORDER.index)) + 'vK' + \
+        ''.join(sorted(black, key=PIECE_ORDER.index))
+
+
+def split_signature(signature):
+    white, black = signature.upper().split('V')
+    return white[1:], black[1:]
+
+
+def canonical_signature(signature):
+    """The signature with the stronger side first, which is how tables are stored"""
+    white, black = split_signature(signature)
+    strength = lambda pieces: (sum(PIECE_WORTH[p] for p in pieces), len(pieces), pieces)
+    if strength(black) > strength(white):
+        white, black = black, white
+    return material_signature(white, black)
+
+
+def is_insufficient(white, black):
+    """Kings alone, or one bishop or knight against a bare king"""
+    pieces = white + black
+    return not pieces or (len(pieces) == 1 and pieces in 'BN')
+
+
+class TableLayout:
+    """Index arithmetic for one material balance"""
+    def __init__(self, signature):
+        self.signature = signature
+        white, black = split_signature(signature)
+        # Piece letters in index order after the two kings
+        self.pieces = ['K', 'k'] + list(white) + [piece.lower() for piece in black]
+        self.has_pawns = 'P' in white + black
+        self.king_squares = [square for square in range(64)
+                             if square & 7 < 4 and (self.has_pawns or square >> 3 >= 4)]
+        self.king_slot = {square: slot for slot, square in enumerate(self.king_squares)}
+        self.size = len(self.king_squares) * 64 ** (len(self.pieces) - 1) * 2
+
+    def transform(self, white_king):
+        """Square xor that moves the white king into the indexed region"""
+        flip = 7 if white_king & 7 >= 4 else 0
+        if not self.has_pawns and (white_king ^ flip) >> 3 < 4:
+            flip ^= 56
+        return flip
+
+    def index(self, squares, black_to_move):
+        flip = self.transform(squares[0])
+        index = self.king_slot[squares[0] ^ flip]
+        for square in squares[1:]:
+            index = index * 64 + (square ^ flip)
+        return index * 2 + black_to_move
+
+    def decode(self, index):
+        black_to_move = index & 1
+        index >>= 1
+        squares = []
+        for _ in range(len(self.pieces) - 1):
+            index, square = divmod(index, 64)
+            squares.append(square)
+        squares.append(self.king_squares[index])
+        squares.reverse()
+        return squares, black_to_move
+
+    def position(self, squares, black_to_move):
+        """Position for a square list, or None if pieces overlap or pawns are on an end rank"""
+        if len(set(squares)) != len(squares):
+            return None
+        position = Position()
+        for piece, square in zip(self.pieces, squares):
+            if piece in 'Pp' and square >> 3 in (0, 7):
+                return None
+            position.put_piece(square, piece)
+        position.turn = BLACK if black_to_move else WHITE
+        if position.in_check(OPPONENT[position.turn]):
+            return None
+        return position
+
+
+def decode_value(value):
+    """Table byte -> search score for the side to move, or None if not a legal position"""
+    if value == INVALID:
+        return None
+    if value == DRAW:
+        return 0
+    plies = value - 1
+    return MATE_SCORE - plies if plies & 1 else -MATE_SCORE + plies
+
+
+class Tablebase:
+    """The memory-mapped tables found in a directory"""
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.directory = directory
+        self.tables = {}
+        self.max_pieces = 0
+        if os.path.isdir(directory):
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith('.ctb'):
+                    self.load(os.path.join(directory, filename))
+        # Kings alone are always covered
+        self.max_pieces = max(self.max_pieces, 2)
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, name = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            data.close()
+            raise ValueError(f"{path} is not a tablebase")
+        signature = name.rstrip(b'\0').decode()
+        layout = TableLayout(signature)
+        self.tables[signature] = (layout, data)
+        self.max_pieces = max(self.max_pieces, len(layout.pieces))
+
+    def close(self):
+        for layout, data in self.tables.values():
+            data.close()
+        self.tables = {}
+
+    def __contains__(self, signature):
+        return canonical_signature(signature) in self.tables
+
+    def probe(self, position):
+        """Score for the side to move, or None if no table covers the position.
+
+        Draws score 0 and mates MATE_SCORE less the plies to mate, as the
+        search scores them from the root.
+        """
+        occupied = position.occupied
+        if popcount(occupied) > self.max_pieces:
+            return None
+        bitboards = position.bitboards
+        white = ''.join(piece * popcount(bitboards[piece]) for piece in PIECE_ORDER)
+        black = ''.join(piece * popcount(bitboards[piece.lower()]) for piece in PIECE_ORDER)
+        if is_insufficient(white, black):
+            return 0
+        entry = self.tables.get(material_signature(white, black))
+        flip = 0
+        black_to_move = position.turn == BLACK
+        if entry is None:
+            # Stored the other way round: swap the colors and mirror the ranks
+            entry = self.tables.get(material_signature(black, white))
+            if entry is None:
+                return None
+            flip = 56
+            black_to_move = not black_to_move
+        layout, data = entry
+        squares = []
+        for piece in dict.fromkeys(layout.pieces):
+            board_piece = piece.swapcase() if flip else piece
+            squares.extend(square ^ flip for square in iter_bits(bitboards[board_piece]))
+        return decode_value(data[HEADER.size + layout.index(squares, black_to_move)])
+
+
+# Generation
+def _unmove_squares(piece, square, occupied):
+    """Squares piece could have moved to square from, without capturing"""
+    kind = piece.upper()
+    if kind == 'P':
+        step = 8 if piece == 'P' else -8
+        back = square + step
+        if not 1 <= back >> 3 <= 6 or occupied >> back & 1:
+            return []
+        squares = [back]
+        # A double step from the pawn's home rank
+        home = back + step
+        if (piece == 'P' and home >> 3 == 6 or piece == 'p' and home >> 3 == 1) and not occupied >> home & 1:
+            squares.append(home)
+        return squares
+    if kind == 'K':
+        attacks = KING_ATTACKS[square]
+    elif kind == 'N':
+        attacks = KNIGHT_ATTACKS[square]
+    elif kind == 'B':
+        attacks = bishop_attacks(square, occupied)
+    elif kind == 'R':
+        attacks = rook_attacks(square, occupied)
+    else:
+        attacks = queen_attacks(square, occupied)
+    return list(iter_bits(attacks & ~occupied))
+
+
+def _exit_signatures(signature):
+    """Material reachable from signature by one capture or promotion"""
+    white, black = split_signature(signature)
+    reachable = set()
+    for own, other, own_first in ((white, black, True), (black, white, False)):
+        for i, piece in enumerate(other):
+            pair = (own, other[:i] + other[i + 1:])
+            reachable.add(pair if own_first else pair[::-1])
+        for i, piece in enumerate(own):
+            if piece == 'P':
+                for promoted in 'QRBN':
+                    pair = (own[:i] + promoted + own[i + 1:], other)
+                    reachable.add(pair if own_first else pair[::-1])
+    return {material_signature(w, b) for w, b in reachable}
+
+
+def generate_table(signature, directory=TABLEBASE_DIR, verbose=True):
+    """Build one table, and any smaller ones it needs first; returns its path"""
+    signature = canonical_signature(signature)
+    path = os.path.join(directory, signature + '.ctb')
+    if os.path.exists(path):
+        return path
+    white, black = split_signature(signature)
+    if len(white) + len(black) + 2 > MAX_PIECES:
+        raise ValueError(f"{signature}: tables go up to {MAX_PIECES} pieces")
+    os.makedirs(directory, exist_ok=True)
+    for exit_signature in sorted(_exit_signatures(signature)):
+        if not is_insufficient(*split_signature(exit_signature)):
+            generate_table(exit_signature, directory, verbose)
+
+    started = time.time()
+    tablebase = Tablebase(directory)
+    layout = TableLayout(signature)
+    # values holds 1 + plies once a position is resolved, like the file
+    values = bytearray(layout.size)
+    open_moves = array('B', [0]) * layout.size
+    longest_loss = bytearray(layout.size)
+    buckets = [[]]
+
+    def push(index, plies):
+        while len(buckets) <= plies:
+            buckets.append([])
+        buckets[plies].append(index)
+
+    # Pass 1: find legal positions and mates, count the moves that stay in
+    # this table and settle the ones that leave it
+    index = 0
+    others = len(layout.pieces) - 2
+    for king in layout.king_squares:
+        for rest in itertools.product(range(64), repeat=others + 1):
+            for black_to_move in (0, 1):
+                squares = (king,) + rest
+                position = layout.position(squares, black_to_move)
+                if position is None:
+                    values[index] = INVALID
+                    index += 1
+                    continue
+                moves = generate_legal_moves(position)
+                if not moves:
+                    if position.in_check():
+                        push(index, 0)
+                    index += 1
+                    continue
+                count = 0
+                best_win = None
+                for move in moves:
+                    end = (move >> 6) & 63
+                    if position.squares[end] == EMPTY and not move >> 12:
+                        count += 1
+                        continue
+                    undo = position.make_move(move)
+                    score = tablebase.probe(position)
+                    position.unmake_move(undo)
+                    if score < 0:
+                        # The opponent gets mated after this capture or promotion
+                        plies = MATE_SCORE + score
+                        best_win = plies if best_win is None else min(best_win, plies)
+                        count += 1
+                    elif score > 0:
+                        longest_loss[index] = max(longest_loss[index], MATE_SCORE - score)
+                    else:
+                        count += 1  # A draw this side can always fall back on
+                if best_win is not None:
+                    push(index, best_win + 1)
+                elif not count:
+                    push(index, longest_loss[index] + 1)
+                open_moves[index] = count
+                index += 1
+
+    # Pass 2: resolve positions in order of distance to mate, walking moves
+    # backwards from each one that is settled
+    plies = 0
+    while plies < len(buckets):
+        for index in buckets[plies]:
+            if values[index]:
+                continue
+            values[index] = plies + 1
+            squares, black_to_move = layout.decode(index)
+            white_moved = black_to_move == 1
+            occupied = 0
+            for square in squares:
+                occupied |= 1 << square
+            for i, piece in enumerate(layout.pieces):
+                if piece.isupper() != white_moved:
+                    continue  # Only the side that just moved can have got here
+                for origin in _unmove_squares(piece, squares[i], occupied):
+                    before = list(squares)
+                    before[i] = origin
+                    if layout.position(before, 1 - black_to_move) is None:
+                        continue
+                    previous = layout.index(before, 1 - black_to_move)
+                    if values[previous]:
+                        continue
+                    if plies & 1 == 0:
+                        # The side to move here is mated: moving here wins
+                        push(previous, plies + 1)
+                    else:
+                        open_moves[previous] -= 1
+                        longest_loss[previous] = max(longest_loss[previous], plies)
+                        if not open_moves[previous]:
+                            push(previous, longest_loss[previous] + 1)
+        plies += 1
+
+    if len(buckets) > INVALID - 1:
+        raise ValueError(f"{signature}: mates longer than {INVALID - 2} plies don't fit the format")
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, signature.encode()))
+        f.write(values)
+    os.replace(temp_path, path)
+    tablebase.close()
+    if verbose:
+        wins = sum(1 for value in values if value not in (DRAW, INVALID) and (value - 1) & 1)
+        print(f"{signature}: {layout.size} positions, {wins} wins for the side to move, "
+              f"longest mate {len(buckets) - 1} plies, {time.time() - started:.1f}s")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases")
+    parser.add_argument("tables", nargs='*', default=DEFAULT_TABLES, help="material such as KQvK or KRvKP")
+    parser.add_argument("--dir", default=TABLEBASE_DIR)
+    args = parser.parse_args(argv)
+    for signature in args.tables:
+        generate_table(signature, args.dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
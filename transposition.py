@@ -0,0 +1,137 @@
+"""Fixed-size transposition table keyed by Position.hash.
+
+Entries live in flat typed arrays so the table's memory use is set up front
+by size_mb and never grows. Each bucket has two slots: a depth-preferred
+slot that keeps the deepest result of the current search, and an
+always-replace slot that takes whatever the depth-preferred slot turns down.
+
+SharedTranspositionTable keeps the same slots in one shared memory buffer so
+the worker processes of a parallel search all read and fill one table.
+"""
+import multiprocessing
+from array import array
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+# Bytes per slot: key (8) + score (4) + move (4) + depth (2) + bound (1) + age (1)
+SLOT_BYTES = 20
+SLOTS_PER_BUCKET = 2
+
+
+class TranspositionTable:
+    def __init__(self, size_mb=16):
+        self.size_mb = size_mb
+        self.buckets = max(1, int(size_mb * 1024 * 1024) // (SLOT_BYTES * SLOTS_PER_BUCKET))
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        slots = self.buckets * SLOTS_PER_BUCKET
+        self.keys = array('Q', [0]) * slots
+        self.scores = array('i', [0]) * slots
+        self.moves = array('I', [0]) * slots
+        self.depths = array('h', [-1]) * slots
+        self.bounds = array('B', [0]) * slots
+        self.ages = array('B', [0]) * slots
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def new_search(self):
+        """Age existing entries so the depth-preferred slots can be reused"""
+        self.generation = (self.generation + 1) & 0xFF
+
+    def probe(self, key):
+        """Return (depth, bound, score, move) for key, or None"""
+        self.probes += 1
+        slot = (key % self.buckets) * SLOTS_PER_BUCKET
+        for index in (slot, slot + 1):
+            if self.keys[index] == key and self.depths[index] >= 0:
+                self.hits += 1
+                return self.depths[index], self.bounds[index], self.scores[index], self.moves[index]
+        return None
+
+    def store(self, key, depth, bound, score, move):
+        self.stores += 1
+        slot = (key % self.buckets) * SLOTS_PER_BUCKET
+        keys = self.keys
+        depths = self.depths
+        # Depth-preferred slot: same position, deeper result, or left over
+        # from an earlier search
+        if keys[slot] == key or depth >= depths[slot] or self.ages[slot] != self.generation:
+            index = slot
+        else:
+            index = slot + 1
+        if depths[index] >= 0 and keys[index] != key:
+            self.replacements += 1
+        if keys[index] == key and move == 0:
+            move = self.moves[index]  # Keep the old best move rather than forget it
+        keys[index] = key
+        depths[index] = depth
+        self.bounds[index] = bound
+        self.scores[index] = score
+        self.moves[index] = move
+        self.ages[index] = self.generation
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def usage(self, sample=2000):
+        """Fraction of slots in use, estimated from the first sample slots"""
+        sample = min(sample, len(self.depths))
+        return sum(1 for depth in self.depths[:sample] if depth >= 0) / sample
+
+    def stats(self):
+        return {
+            'size_mb': self.size_mb,
+            'slots': len(self.keys),
+            'probes': self.probes,
+            'hits': self.hits,
+            'hit_rate': round(self.hit_rate, 4),
+            'stores': self.stores,
+            'replacements': self.replacements,
+            'usage': round(self.usage(), 4),
+        }
+
+
+# Typecode of each slot field, widest first so every field stays aligned
+SLOT_FIELDS = [('keys', 'Q'), ('scores', 'i'), ('moves', 'I'), ('depths', 'h'), ('bounds', 'B'), ('ages', 'B')]
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """Transposition table in a shared memory buffer.
+
+    Create it in the parent process and hand table.buffer to each worker,
+    which attaches with SharedTranspositionTable(size_mb, buffer). Writes
+    are not locked; a slot torn by two processes writing at once can only
+    give a wrong score or a hash move that is checked against the legal
+    moves before use, the same trade multi-threaded engines make.
+    """
+    def __init__(self, size_mb=16, buffer=None):
+        self.size_mb = size_mb
+        self.buckets = max(1, int(size_mb * 1024 * 1024) // (SLOT_BYTES * SLOTS_PER_BUCKET))
+        self.generation = 0
+        slots = self.buckets * SLOTS_PER_BUCKET
+        attach = buffer is not None
+        self.buffer = buffer if attach else multiprocessing.RawArray('B', slots * SLOT_BYTES)
+        view = memoryview(self.buffer).cast('B')
+        offset = 0
+        for name, typecode in SLOT_FIELDS:
+            size = slots * array(typecode).itemsize
+            setattr(self, name, view[offset:offset + size].cast(typecode))
+            offset += size
+        if attach:
+            self.reset_stats()
+        else:
+            self.clear()
+
+    def clear(self):
+        slots = self.buckets * SLOTS_PER_BUCKET
+        for name, typecode in SLOT_FIELDS:
+            getattr(self, name)[:] = array(typecode, [-1 if name == 'depths' else 0]) * slots
+        self.reset_stats()
@@ -0,0 +1,213 @@
+"""UCI front end for the engine, so it can be driven by a chess GUI or arena.
+
+Reads UCI commands on stdin and answers on stdout with no prompts, colors or
+sleeps. Searches run on a worker thread, so 'stop', 'isready' and 'quit' are
+answered while the engine is thinking.
+
+    python uci.py
+
+Supported commands: uci, isready, ucinewgame, setoption name Hash value N,
+position [startpos | fen <fen>] [moves ...], go [wtime btime winc binc
+movestogo movetime depth infinite], stop, quit.
+"""
+import sys
+import threading
+
+from position import START_FEN, Position, generate_legal_moves, move_to_uci, uci_to_move
+from search import MATE_SCORE, MATE_THRESHOLD, Search
+from tablebase import Tablebase
+from transposition import TranspositionTable
+
+ENGINE_NAME = "Console Chess AI"
+ENGINE_AUTHOR = "Console Chess AI authors"
+
+DEFAULT_HASH_MB = 16
+MAX_HASH_MB = 1024
+
+# Seconds kept back from every move for the GUI and the time between node
+# count checks in the search
+MOVE_OVERHEAD = 0.05
+# Moves the remaining clock is shared between when the GUI does not say
+DEFAULT_MOVES_TO_GO = 30
+
+
+def parse_uci_move(position, text):
+    """Packed legal move for a UCI move string such as 'e2e4' or 'e7e8q', or None"""
+    try:
+        move = uci_to_move(text)
+    except ValueError:
+        return None
+    return move if move in generate_legal_moves(position) else None
+
+
+def format_score(score):
+    if score >= MATE_THRESHOLD:
+        return f"mate {(MATE_SCORE - score + 1) // 2}"
+    if score <= -MATE_THRESHOLD:
+        return f"mate -{(MATE_SCORE + score) // 2}"
+    return f"cp {score}"
+
+
+def allocate_time(remaining, increment=0, moves_to_go=None):
+    """Seconds to spend on a move given the clock in milliseconds"""
+    moves_to_go = moves_to_go or DEFAULT_MOVES_TO_GO
+    budget = remaining / moves_to_go + increment * 0.75
+    budget = min(budget, remaining / 2) / 1000 - MOVE_OVERHEAD
+    return max(budget, 0.01)
+
+
+class UCIEngine:
+    def __init__(self, output=None):
+        self.output = output or sys.stdout
+        self.output_lock = threading.Lock()
+        self.hash_mb = DEFAULT_HASH_MB
+        self.search = Search(tt=TranspositionTable(self.hash_mb), tablebase=Tablebase())
+        self.search.on_iteration = self.report_iteration
+        self.position = Position.from_fen(START_FEN)
+        self.thread = None
+        # Set by stop; under 'go infinite' bestmove waits for it even if the
+        # search ends by itself
+        self.stop_requested = threading.Event()
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def handle(self, line):
+        """Act on one command line; returns False once the engine should exit"""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {DEFAULT_HASH_MB} min 1 max {MAX_HASH_MB}")
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'ucinewgame':
+            self.wait_for_search()
+            self.search.tt.clear()
+            self.position = Position.from_fen(START_FEN)
+        elif command == 'setoption':
+            self.set_option(args)
+        elif command == 'position':
+            self.wait_for_search()
+            self.set_position(args)
+        elif command == 'go':
+            self.wait_for_search()
+            self.go(args)
+        elif command == 'stop':
+            self.wait_for_search()
+        elif command == 'quit':
+            self.wait_for_search()
+            return False
+        else:
+            self.send(f"info string unknown command {command}")
+        return True
+
+    def set_option(self, args):
+        # setoption name <name> value <value>
+        if 'name' not in args:
+            return
+        name_end = args.index('value') if 'value' in args else len(args)
+        name = ' '.join(args[args.index('name') + 1:name_end]).lower()
+        value = ' '.join(args[name_end + 1:])
+        if name == 'hash':
+            try:
+                self.hash_mb = min(max(int(value), 1), MAX_HASH_MB)
+            except ValueError:
+                self.send(f"info string invalid Hash value {value!r}")
+                return
+            self.wait_for_search()
+            self.search.tt = TranspositionTable(self.hash_mb)
+        else:
+            self.send(f"info string unknown option {name}")
+
+    def set_position(self, args):
+        if not args:
+            return
+        moves_at = args.index('moves') if 'moves' in args else len(args)
+        if args[0] == 'startpos':
+            position = Position.from_fen(START_FEN)
+        elif args[0] == 'fen':
+            try:
+                position = Position.from_fen(' '.join(args[1:moves_at]))
+            except (ValueError, IndexError) as e:
+                self.send(f"info string invalid fen: {e}")
+                return
+        else:
+            self.send("info string invalid position command")
+            return
+        for text in args[moves_at + 1:]:
+            move = parse_uci_move(position, text)
+            if move is None:
+                self.send(f"info string illegal move {text}")
+                break
+            position.make_move(move)
+        self.position = position
+
+    def go(self, args):
+        options = {}
+        for name, value in zip(args, args[1:] + ['']):
+            if name in ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'movetime', 'depth'):
+                try:
+                    options[name] = int(value)
+                except ValueError:
+                    self.send(f"info string invalid {name} value {value!r}")
+
+        search = self.search
+        search.max_depth = options.get('depth', 64)
+        if 'movetime' in options:
+            search.time_limit = max(options['movetime'] / 1000 - MOVE_OVERHEAD, 0.01)
+        elif 'wtime' in options or 'btime' in options:
+            side = 'w' if self.position.turn == 'white' else 'b'
+            search.time_limit = allocate_time(options.get(side + 'time', 0), options.get(side + 'inc', 0),
+                                              options.get('movestogo'))
+        else:
+            # 'infinite', a bare 'go' or a depth limit: search until stopped
+            search.time_limit = None
+        search.stopped = False
+        search.tt.reset_stats()
+        self.stop_requested.clear()
+        self.thread = threading.Thread(target=self.run_search, args=(self.position.copy(), 'infinite' in args),
+                                       daemon=True)
+        self.thread.start()
+
+    def run_search(self, position, infinite=False):
+        move = self.search.search(position)[0]
+        if infinite:
+            self.stop_requested.wait()
+        tt = self.search.tt
+        self.send(f"info string hash {tt.size_mb} MB, {tt.hits}/{tt.probes} probes hit "
+                  f"({tt.hit_rate:.1%}), {tt.replacements} replacements")
+        self.send(f"bestmove {move_to_uci(move) if move else '0000'}")
+
+    def report_iteration(self, depth, score, nodes, seconds, pv):
+        nps = int(nodes / seconds) if seconds > 0 else 0
+        self.send(f"info depth {depth} score {format_score(score)} nodes {nodes} nps {nps} "
+                  f"hashfull {int(self.search.tt.usage() * 1000)} time {int(seconds * 1000)} pv {' '.join(move_to_uci(move) for move in pv)}")
+
+    def wait_for_search(self):
+        """Stop any search in progress and wait for its bestmove to be sent"""
+        if self.thread is not None:
+            self.search.stop()
+            self.stop_requested.set()
+            self.thread.join()
+            self.thread = None
+
+
+def main():
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    else:
+        engine.wait_for_search()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())